@@ -0,0 +1,333 @@
+"""
+异步预约
+Booking 的 asyncio 版本，所有任务共用一个带连接池的 httpx.AsyncClient；
+FanOutBooking 为同一账号并发预约多个备选场馆
+"""
+import asyncio
+import http.cookiejar
+import json
+import logging
+import time
+from datetime import date
+from urllib.parse import urlencode, urlsplit
+import httpx
+from config import Config
+from metrics import BOOKING_REQUEST_SECONDS, BOOKING_REQUESTS_IN_FLIGHT
+from session_pool import session_pool, is_session_rejected
+from retry_engine import RetryEngine, RetryPolicy, RetryableError, CANCELLED, FAILURE, DAILY_LIMIT_MESSAGE, outcome_class
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_host_semaphores = {}
+
+
+class _RejectAllCookiePolicy(http.cookiejar.DefaultCookiePolicy):
+    """不保存任何响应 Cookie：共享客户端被多个账号使用，会话 Cookie 只通过请求头显式携带"""
+
+    def set_ok(self, cookie, request):
+        return False
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """获取进程内共享的异步 HTTP 客户端（需在事件循环中调用）"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=Config.ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=Config.ASYNC_MAX_CONNECTIONS,
+                keepalive_expiry=Config.ASYNC_KEEPALIVE_EXPIRY
+            ),
+            timeout=Config.REQUEST_TIMEOUT,
+            follow_redirects=True,
+            # 不持久化 Cookie，避免一个账号的 Set-Cookie 在后续请求或重定向中被其他账号带上
+            cookies=http.cookiejar.CookieJar(policy=_RejectAllCookiePolicy())
+        )
+    return _client
+
+
+async def close_async_client():
+    """关闭共享客户端，应用关闭时调用"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    _host_semaphores.clear()
+
+
+def host_semaphore(url: str) -> asyncio.Semaphore:
+    """按主机限制同时在途的请求数"""
+    host = urlsplit(url).netloc
+    semaphore = _host_semaphores.get(host)
+    if semaphore is None:
+        semaphore = _host_semaphores[host] = asyncio.Semaphore(Config.ASYNC_MAX_PER_HOST)
+    return semaphore
+
+
+class AsyncBooking:
+    """异步预约，参数与 Booking 相同；登录仍通过会话池完成，请求携带该会话的 Cookie"""
+
+    def __init__(self, stockid='', serviceid='', id='', users='', username='', password='', retry_policy=None):
+        self.stockid = stockid
+        self.serviceid = serviceid
+        self.id = id
+        self.users = users
+        self.username = username
+        self.password = password
+        self.retry_policy = retry_policy or RetryPolicy()
+        # 附加到本次预约所有日志的字段
+        self.log_context = {"account": username, "stockid": stockid}
+        # 登录和每次 POST 的时间线，时间为单调时钟
+        self.events = []
+        self.session = None
+        self.book_url = f"{Config.BASE_URL}/cgyd/order/tobook.html"
+        self.payload = {
+            "param": {
+                "stockdetail": {str(self.stockid): str(self.id)},
+                "serviceid": self.serviceid,
+                "stockid": f"{self.stockid},",
+                "remark": "",
+                "users": self.users
+            },
+            "num": 1,
+            "json": True
+        }
+
+        # 将 payload 字典转换为 URL 编码的字符串
+        self.encoded_payload = urlencode({
+            "param": json.dumps(self.payload["param"]),
+            "num": self.payload["num"],
+            "json": self.payload["json"]
+        })
+
+        self.headers = {
+            "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+            "X-Requested-With": "XMLHttpRequest",
+            "Referer": f"{Config.BASE_URL}/cgyd/product/show.html?id={self.serviceid}"
+        }
+
+    async def _checkout(self, invalidate: bool = False):
+        """从会话池取出登录会话（登录是阻塞请求，放到线程中执行）"""
+        if invalidate:
+            session_pool.invalidate(self.username, self.session)
+        started = time.monotonic()
+        self.session, logged_in = await asyncio.to_thread(session_pool.acquire, self.username, self.password)
+        # 只记录真正的登录，会话池命中记为 reuse，不影响登录耗时的统计
+        self._record("login" if logged_in else "reuse", started)
+        cookies = "; ".join(f"{cookie.name}={cookie.value}" for cookie in self.session.cookies)
+        # 显式的 Cookie 头优先于共享客户端自身的 Cookie，不同账号互不影响
+        self.headers["Cookie"] = cookies
+
+    async def prepare(self):
+        """准备阶段：登录并取得会话 Cookie"""
+        if self.session is None:
+            await self._checkout()
+
+    async def warm_up(self):
+        """访问预约页面，确认会话有效并建立好 keep-alive 连接"""
+        await self.prepare()
+        client = get_async_client()
+        response = await client.get(self.headers["Referer"], headers={"Cookie": self.headers["Cookie"]})
+        if is_session_rejected(response, expect_json=False):
+            await self._checkout(invalidate=True)
+            await client.get(self.headers["Referer"], headers={"Cookie": self.headers["Cookie"]})
+
+    def _record(self, event: str, started: float, outcome: str = None, message: str = None):
+        self.events.append({
+            "event": event,
+            "started": started,
+            "finished": time.monotonic(),
+            "outcome": outcome,
+            "message": message,
+        })
+
+    async def _send_recorded(self):
+        """发送一次预约请求，并把发送、收到响应的时刻和服务器 message 记入时间线"""
+        started = time.monotonic()
+        try:
+            result = await self._send()
+        except RetryableError as e:
+            self._record("post", started, outcome_class(error=e), str(e))
+            raise
+        self._record("post", started, outcome_class(result), result.get("message"))
+        return result
+
+    async def _send(self):
+        """发送一次预约请求，返回服务器的 JSON 结果"""
+        client = get_async_client()
+        try:
+            async with host_semaphore(self.book_url):
+                with BOOKING_REQUESTS_IN_FLIGHT.track_inprogress(), BOOKING_REQUEST_SECONDS.time(client="async"):
+                    response = await client.post(self.book_url, content=self.encoded_payload, headers=self.headers)
+        except httpx.HTTPError as e:
+            raise RetryableError(f"请求异常: {str(e)}")
+        # 会话被服务器拒绝时，使其失效并重新登录
+        if is_session_rejected(response):
+            logger.info("会话已失效，重新登录", extra=self.log_context)
+            await self._checkout(invalidate=True)
+            raise RetryableError("会话已失效")
+        if response.status_code != 200:
+            logger.warning("请求失败，状态码: %s", response.status_code, extra=self.log_context)
+            raise RetryableError(f"请求失败，状态码: {response.status_code}")
+        return response.json()
+
+    async def pre_book(self, policy: RetryPolicy = None, stop: asyncio.Event = None):
+        """发送预约请求并按重试策略重试，返回包含每次尝试耗时的结果
+
+        stop 被设置后不再发起新的尝试，用于多场馆并发预约时停止其余请求
+        """
+        await self.prepare()
+        result = await RetryEngine(policy or self.retry_policy, context=self.log_context).run_async(self._send_recorded, stop=stop)
+        log_extra = {
+            **self.log_context,
+            "outcome": result["outcome"],
+            "attempts": len(result["attempts"]),
+            "elapsed": result["elapsed"],
+        }
+        if result["success"]:
+            logger.info("预约成功！%s", result["message"], extra=log_extra)
+        else:
+            logger.info("预约失败：%s（共尝试 %d 次）", result["message"], len(result["attempts"]), extra=log_extra)
+        return result
+
+
+class FanOutBooking:
+    """同一账号对多个备选场馆并发发起预约，任一成功或触发每日限制后停止其余请求
+
+    服务器限制每个账号每日只能预约一场，所以同一账号同一日期的并发预约共用一个停止信号，
+    已成功的账号日期不再发起新的请求
+    """
+
+    # (username, booking_date) -> [asyncio.Event, 引用计数]
+    _stops = {}
+    # 本进程内已预约成功的 (username, booking_date)，预约日期过后移除
+    _won = set()
+
+    def __init__(self, books, booking_date: str, task_id: int = None):
+        """books 为按优先级排序的 (venue_id, AsyncBooking) 列表，需属于同一账号"""
+        self.books = books
+        self.booking_date = booking_date
+        self.task_id = task_id
+        self.key = (books[0][1].username, booking_date)
+        for venue_id, book in books:
+            book.log_context.update(task_id=task_id, venue_id=venue_id)
+
+    async def prepare(self):
+        await asyncio.gather(*(book.prepare() for _, book in self.books))
+
+    def timeline(self) -> list:
+        """各场馆的登录和 POST 记录，按开始时刻排序，POST 按场馆编号尝试次数"""
+        events = []
+        for venue_id, book in self.books:
+            attempt = 0
+            for event in book.events:
+                if event["event"] == "post":
+                    attempt += 1
+                events.append({**event, "venue_id": venue_id, "attempt": attempt if event["event"] == "post" else None})
+        return sorted(events, key=lambda event: event["started"])
+
+    async def warm_up(self):
+        # 各场馆共用同一账号的会话和连接，只需预热一次
+        await self.books[0][1].warm_up()
+        await self.prepare()
+
+    def _acquire_stop(self) -> asyncio.Event:
+        entry = FanOutBooking._stops.get(self.key)
+        if entry is None:
+            entry = FanOutBooking._stops[self.key] = [asyncio.Event(), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def _release_stop(self):
+        entry = FanOutBooking._stops.get(self.key)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del FanOutBooking._stops[self.key]
+
+    @staticmethod
+    def _is_decisive(result: dict) -> bool:
+        """成功或触发每日限制后，同账号同日期的其他请求都没有意义"""
+        return result["success"] or DAILY_LIMIT_MESSAGE in (result["message"] or "")
+
+    @staticmethod
+    def _prune_won():
+        """移除预约日期已过的记录，避免常驻进程中集合持续增长"""
+        today = date.today().isoformat()
+        FanOutBooking._won = {key for key in FanOutBooking._won if key[1] >= today}
+
+    async def pre_book(self, policy: RetryPolicy = None):
+        """并发预约所有备选场馆，返回决定性结果（没有时为主场馆的结果）及各场馆概要"""
+        FanOutBooking._prune_won()
+        if self.key in FanOutBooking._won:
+            return {
+                "success": False,
+                "outcome": CANCELLED,
+                "message": "该账号当日已预约成功，不再发起请求",
+                "response": None,
+                "elapsed": 0,
+                "attempts": [],
+                "venue_id": None,
+                "candidates": [],
+            }
+
+        stop = self._acquire_stop()
+        tasks = {
+            asyncio.create_task(book.pre_book(policy, stop=stop)): venue_id
+            for venue_id, book in self.books
+        }
+        results = {}
+        decisive = None
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    venue_id = tasks[task]
+                    if task.cancelled():
+                        results[venue_id] = {"success": False, "outcome": CANCELLED, "message": "已停止", "attempts": []}
+                        continue
+                    error = task.exception()
+                    if error is not None:
+                        # 重新登录失败等异常只让该场馆失败，其余场馆继续
+                        logger.warning("场馆 %s 预约异常: %s", venue_id, error,
+                                       extra={**self.books[0][1].log_context, "venue_id": venue_id})
+                        results[venue_id] = {
+                            "success": False, "outcome": FAILURE, "message": f"预约异常: {error}",
+                            "response": None, "elapsed": 0, "attempts": [],
+                        }
+                        continue
+                    results[venue_id] = task.result()
+                    if decisive is None and self._is_decisive(results[venue_id]):
+                        decisive = venue_id
+                        # 其余请求不再发起新的尝试，但已发出的请求要等到响应：
+                        # 每日限制的响应可能先于同账号另一场馆的成功响应返回
+                        stop.set()
+        finally:
+            # 被外部取消时，不留下仍在发送请求的场馆任务
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            self._release_stop()
+
+        succeeded = [venue_id for venue_id, _ in self.books if results.get(venue_id, {}).get("success")]
+        if succeeded:
+            decisive = succeeded[0]
+        chosen_id = decisive if decisive is not None else self.books[0][0]
+        summary = dict(results[chosen_id])
+        if summary["success"]:
+            FanOutBooking._won.add(self.key)
+        summary["venue_id"] = chosen_id
+        summary["candidates"] = [
+            {
+                "venue_id": venue_id,
+                "outcome": results[venue_id]["outcome"],
+                "message": results[venue_id]["message"],
+                "attempts": len(results[venue_id]["attempts"]),
+            }
+            for venue_id, _ in self.books
+        ]
+        return summary
@@ -0,0 +1,97 @@
+"""
+预约执行时间线
+把一次触发中各场馆的登录和 POST 记录转换为 auto_booking_attempts 表的行，
+并按早晨汇总多个任务的耗时分位数
+"""
+import math
+
+PERCENTILES = (50, 90, 99)
+
+
+def build_attempt_rows(task_id: int, book, origin: float, server_offset: float) -> list:
+    """book 为 FanOutBooking，origin 为触发时刻（单调时钟），时间换算为相对触发时刻的秒数"""
+    rows = [{
+        "booking_id": task_id,
+        "event": "fire",
+        "venue_id": None,
+        "attempt": None,
+        "started": 0.0,
+        "finished": None,
+        "outcome": None,
+        "message": None,
+        "server_offset_ms": round(server_offset * 1000, 3),
+    }]
+    for event in book.timeline():
+        rows.append({
+            "booking_id": task_id,
+            "event": event["event"],
+            "venue_id": event["venue_id"],
+            "attempt": event["attempt"],
+            "started": round(event["started"] - origin, 6),
+            "finished": round(event["finished"] - origin, 6),
+            "outcome": event["outcome"],
+            "message": (event["message"] or "")[:200] or None,
+            "server_offset_ms": None,
+        })
+    return rows
+
+
+def attempt_to_dict(attempt) -> dict:
+    return {
+        "event": attempt.event,
+        "venue_id": attempt.venue_id,
+        "attempt": attempt.attempt,
+        "started_ms": round(attempt.started * 1000, 3),
+        "finished_ms": None if attempt.finished is None else round(attempt.finished * 1000, 3),
+        "elapsed_ms": None if attempt.finished is None else round((attempt.finished - attempt.started) * 1000, 3),
+        "outcome": attempt.outcome,
+        "message": attempt.message,
+        "server_offset_ms": attempt.server_offset_ms,
+    }
+
+
+def percentiles(values) -> dict:
+    """最近秩法计算的分位数（毫秒），没有数据时各项为 None"""
+    values = sorted(values)
+    summary = {"count": len(values)}
+    for p in PERCENTILES:
+        summary[f"p{p}"] = values[max(math.ceil(p / 100 * len(values)) - 1, 0)] if values else None
+    summary["max"] = values[-1] if values else None
+    return summary
+
+
+def summarize(attempts) -> dict:
+    """按任务汇总时间线，attempts 为多个任务的 AutoBookingAttempt，返回各项耗时的分位数（毫秒）"""
+    tasks = {}
+    for attempt in attempts:
+        tasks.setdefault(attempt.booking_id, []).append(attempt)
+
+    first_send, first_decisive, post_latency, login, attempts_per_task, offsets = [], [], [], [], [], []
+    outcomes = {}
+    for events in tasks.values():
+        posts = [e for e in events if e.event == "post"]
+        if posts:
+            first_send.append(min(e.started for e in posts) * 1000)
+            decisive = [e.finished for e in posts if e.outcome in ("success", "daily_limit")]
+            if decisive:
+                first_decisive.append(min(decisive) * 1000)
+        attempts_per_task.append(len(posts))
+        for e in posts:
+            post_latency.append((e.finished - e.started) * 1000)
+            outcomes[e.outcome] = outcomes.get(e.outcome, 0) + 1
+        login.extend((e.finished - e.started) * 1000 for e in events if e.event == "login")
+        offsets.extend(e.server_offset_ms for e in events if e.event == "fire" and e.server_offset_ms is not None)
+
+    def rounded(summary):
+        return {key: round(value, 3) if isinstance(value, float) else value for key, value in summary.items()}
+
+    return {
+        "tasks": len(tasks),
+        "first_send_ms": rounded(percentiles(first_send)),
+        "first_decisive_ms": rounded(percentiles(first_decisive)),
+        "post_latency_ms": rounded(percentiles(post_latency)),
+        "login_ms": rounded(percentiles(login)),
+        "attempts_per_task": percentiles(attempts_per_task),
+        "server_offset_ms": rounded(percentiles(offsets)),
+        "post_outcomes": outcomes,
+    }
@@ -1,214 +1,449 @@
 """
 自动预约执行器
 检查和执行到期的预约任务
+
+所有任务在同一个事件循环中执行，共用 async_book 中带连接池的异步客户端；
+挂在 FastAPI 时直接运行在应用的事件循环上，单独运行时由 start_scheduler 创建事件循环。
+执行时间由 precise_scheduler 的最小堆定时器管理，任务新增或取消时由路由立即通知。
+
+每个任务分两阶段执行：
+- 准备阶段（执行时间前 Config.PREPARE_AHEAD 秒）：查询账号和场馆、登录、构造请求体、建立连接
+- 触发阶段（执行时间）：只发送最终的 tobook.html 请求，同一时刻到期的任务并发发出
+
+同一时刻到期的任务合并为一批：一次查询加载所有任务及其账号和场馆，整批完成后在一个事务中写回结果。
 """
-import time
-import schedule
+import asyncio
+import logging
 from datetime import datetime, timedelta
 import threading
-from sqlalchemy.orm import Session
-from repositories import AutoBookingRepository
-from book import Booking
+import time
+from repositories import AutoBookingRepository, VenueRepository
+from async_book import AsyncBooking, FanOutBooking, close_async_client
 from main import SessionLocal
-from models import Account, Venue
+from config import Config
+from session_pool import session_pool
+from precise_scheduler import booking_scheduler
+from metrics import BOOKING_TASKS
+from attempt_timeline import build_attempt_rows
+from clock_sync import server_clock
+
+logger = logging.getLogger(__name__)
+
+
+class _WaveBatcher:
+    """把同一轮事件循环中提交的任务合并成一批，交给 func(task_ids) 统一处理"""
+
+    def __init__(self, func):
+        self.func = func
+        self._items = []
+        self._future = None
+
+    async def submit(self, task_id: int):
+        if self._future is None:
+            loop = asyncio.get_running_loop()
+            self._future = loop.create_future()
+            # 定时器在同一轮中启动所有到期任务，下一轮再统一处理
+            loop.call_soon(self._flush)
+        self._items.append(task_id)
+        await asyncio.shield(self._future)
+
+    def _flush(self):
+        items, future = self._items, self._future
+        self._items, self._future = [], None
+
+        def done(task):
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(None)
+
+        asyncio.get_running_loop().create_task(self.func(items)).add_done_callback(done)
+
 
 class AutoBooker:
     """自动预约执行器"""
-    
+
+    # 已完成准备阶段、等待触发的任务: task_id -> FanOutBooking
+    _prepared = {}
+    # 正在执行的任务，防止精确计划和备份检查重复触发同一任务
+    _running = set()
+    # 写回数据库失败、等待重试的执行结果: [(updates, attempts)]，其中的任务在写回成功前保持执行中
+    _unsaved = []
+    _lock = threading.Lock()
+
     @staticmethod
-    def check_and_execute_bookings():
-        """检查并执行到期的预约任务"""
-        print(f"[AutoBooker] 开始检查预约任务，当前时间: {datetime.now()}")
-        
+    def _claim(task_id: int) -> bool:
+        """标记任务开始执行，已在执行中则返回 False"""
+        with AutoBooker._lock:
+            if task_id in AutoBooker._running:
+                return False
+            AutoBooker._running.add(task_id)
+            return True
+
+    @staticmethod
+    def _release(task_id: int):
+        with AutoBooker._lock:
+            AutoBooker._running.discard(task_id)
+
+    @staticmethod
+    def _take_prepared(task_id: int):
+        """取出已准备好的 FanOutBooking，没有则返回 None"""
+        with AutoBooker._lock:
+            return AutoBooker._prepared.pop(task_id, None)
+
+    @staticmethod
+    def discard_prepared(task_id: int):
+        """丢弃已准备的任务（任务被取消或删除时调用）"""
+        AutoBooker._take_prepared(task_id)
+
+    @staticmethod
+    def _build_booking(booking, venues: dict):
+        """用已加载的账号和场馆构造 FanOutBooking，返回 (FanOutBooking, 错误信息)
+
+        主场馆和备选场馆按优先级取前 Config.FANOUT_WIDTH 个，已不存在的场馆跳过
+        """
+        account = booking.account
+        if not account:
+            logger.warning("账号不存在: %s", booking.account_id, extra={"task_id": booking.id})
+            return None, "账号不存在"
+
+        venue_ids = [booking.venue_id] + [candidate.venue_id for candidate in booking.candidates]
+        venue_ids = [venue_id for venue_id in venue_ids if venue_id in venues][:Config.FANOUT_WIDTH]
+        if not venue_ids:
+            logger.warning("场馆不存在: %s", booking.venue_id, extra={"task_id": booking.id})
+            return None, "场馆不存在"
+
+        # 构造预约请求（登录会话在准备阶段从会话池获取）
+        books = [
+            (venue_id, AsyncBooking(
+                stockid=str(venues[venue_id].stockid),
+                serviceid=str(venues[venue_id].serviceid),
+                id=str(venues[venue_id].original_id),
+                users=booking.users,
+                username=account.username,
+                password=account.password
+            ))
+            for venue_id in venue_ids
+        ]
+        return FanOutBooking(books, booking.booking_date, task_id=booking.id), None
+
+    @staticmethod
+    def _load_tasks(task_ids: list) -> dict:
+        """一次加载一批待执行任务及其账号和场馆，构造 FanOutBooking（同步数据库操作，在线程中调用）
+
+        缺少账号或场馆的任务在同一事务中标记为失败，返回 {task_id: FanOutBooking}
+        """
         db = SessionLocal()
         try:
             repo = AutoBookingRepository(db)
-            bookings = repo.get_bookings_to_execute()
-            
-            print(f"[AutoBooker] 找到 {len(bookings)} 个需要执行的预约任务")
-            
+            bookings = repo.get_pending_bookings_by_ids(task_ids)
+            missing = set(task_ids) - {booking.id for booking in bookings}
+            if missing:
+                logger.warning("任务不存在或不处于待执行状态: %s", sorted(missing))
+
+            venue_ids = set()
             for booking in bookings:
-                try:
-                    print(f"[AutoBooker] 执行预约任务 ID: {booking.id}")
-                    
-                    # 查询账号信息
-                    account = db.query(Account).filter(Account.id == booking.account_id).first()
-                    
-                    if not account:
-                        print(f"[AutoBooker] 账号不存在: {booking.account_id}")
-                        repo.update_booking_status(
-                            booking_id=booking.id, 
-                            status="failed", 
-                            result={"error": "账号不存在"}
-                        )
-                        continue
-                    
-                    # 查询场馆信息
-                    venue = db.query(Venue).filter(Venue.id == booking.venue_id).first()
-                    
-                    if not venue:
-                        print(f"[AutoBooker] 场馆不存在: {booking.venue_id}")
-                        repo.update_booking_status(
-                            booking_id=booking.id, 
-                            status="failed", 
-                            result={"error": "场馆不存在"}
-                        )
-                        continue
-                    
-                    # 执行预约
-                    book = Booking(
-                        stockid=str(venue.stockid),
-                        serviceid=str(venue.serviceid),
-                        id=str(venue.original_id),
-                        users=booking.users,
-                        username=account.username,
-                        password=account.password
-                    )
-                    
-                    result = book.pre_book()
-                    
-                    # 更新任务状态
-                    repo.update_booking_status(
-                        booking_id=booking.id,
-                        status="completed",
-                        result=result
-                    )
-                    
-                    print(f"[AutoBooker] 预约成功: {booking.id}")
-                    
-                except Exception as e:
-                    print(f"[AutoBooker] 预约失败: {booking.id}, 错误: {str(e)}")
-                    repo.update_booking_status(
-                        booking_id=booking.id,
-                        status="failed",
-                        result={"error": str(e)}
-                    )
-        
+                venue_ids.add(booking.venue_id)
+                venue_ids.update(candidate.venue_id for candidate in booking.candidates)
+            venues = {venue.id: venue for venue in VenueRepository(db).get_venues_by_ids(list(venue_ids))}
+
+            books, failures = {}, []
+            for booking in bookings:
+                book, error = AutoBooker._build_booking(booking, venues)
+                if book:
+                    books[booking.id] = book
+                else:
+                    failures.append((booking.id, "failed", {"error": error}))
+            repo.bulk_update_status(failures)
+            return books
         finally:
             db.close()
-    
+
     @staticmethod
-    def schedule_precise_tasks():
-        """根据数据库中的任务，安排精确的执行计划"""
+    def _save_results(updates: list, attempts: list = None):
+        """在一个事务中写回一批任务的执行结果和时间线（同步数据库操作，在线程中调用）"""
         db = SessionLocal()
         try:
-            repo = AutoBookingRepository(db)
-            # 获取所有待执行的任务
-            pending_tasks = repo.get_all_pending_bookings()
-            
-            # 清除所有当前计划
-            schedule.clear()
-            
-            # 为每个任务安排精确的执行时间
-            for task in pending_tasks:
-                # 如果执行时间在未来5分钟以内，使用线程安排精确执行
-                now = datetime.now()
-                time_diff = (task.scheduled_time - now).total_seconds()
-                
-                if 0 <= time_diff <= 300:  # 5分钟内
-                    print(f"[AutoBooker] 为任务 {task.id} 安排精确执行计划，将在 {task.scheduled_time} 执行")
-                    # 使用线程安排精确执行
-                    t = threading.Timer(time_diff, AutoBooker.execute_specific_task, args=[task.id])
-                    t.daemon = True
-                    t.start()
-                elif time_diff > 0:
-                    # 仍然保留每小时检查一次的调度
-                    pass
-            
-            # 每小时检查一次，更新执行计划
-            schedule.every(1).hours.do(AutoBooker.schedule_precise_tasks)
-            
-            # 每分钟仍然检查一次，作为备份机制
-            schedule.every(1).minutes.do(AutoBooker.check_and_execute_bookings)
-            
+            AutoBookingRepository(db).bulk_update_status(updates, attempts)
         finally:
             db.close()
-    
+
+    @staticmethod
+    async def _persist_results(updates: list, attempts: list) -> bool:
+        """写回一批执行结果；失败时记录日志，把结果留在内存中并安排重试，返回是否已写回"""
+        try:
+            await asyncio.to_thread(AutoBooker._save_results, updates, attempts)
+            return True
+        except Exception as e:
+            task_ids = [task_id for task_id, _, _ in updates]
+            logger.exception("任务 %s 的执行结果写回失败，%s 秒后重试: %s",
+                             task_ids, Config.RESULT_SAVE_RETRY_INTERVAL, e)
+            AutoBooker._unsaved.append((updates, attempts))
+            booking_scheduler.schedule_at(
+                ("save_results",), datetime.now() + timedelta(seconds=Config.RESULT_SAVE_RETRY_INTERVAL),
+                AutoBooker.retry_unsaved_results
+            )
+            return False
+
+    @staticmethod
+    async def retry_unsaved_results():
+        """重试写回之前失败的执行结果，写回成功后才释放对应任务"""
+        batches, AutoBooker._unsaved = AutoBooker._unsaved, []
+        for updates, attempts in batches:
+            if await AutoBooker._persist_results(updates, attempts):
+                logger.info("任务 %s 的执行结果已写回", [task_id for task_id, _, _ in updates])
+                for task_id, _, _ in updates:
+                    AutoBooker._release(task_id)
+
     @staticmethod
-    def execute_specific_task(task_id: int):
-        """执行特定的预约任务"""
-        print(f"[AutoBooker] 开始执行特定预约任务 ID: {task_id}, 当前时间: {datetime.now()}")
-        
+    def _due_task_ids():
         db = SessionLocal()
         try:
-            repo = AutoBookingRepository(db)
-            # 获取指定任务
-            booking = repo.get_booking_by_id(task_id)
-            
-            if not booking or booking.status != "pending":
-                print(f"[AutoBooker] 任务不存在或不处于待执行状态: {task_id}")
-                return
-                
-            # 查询账号信息
-            account = db.query(Account).filter(Account.id == booking.account_id).first()
-            
-            if not account:
-                print(f"[AutoBooker] 账号不存在: {booking.account_id}")
-                repo.update_booking_status(
-                    booking_id=booking.id, 
-                    status="failed", 
-                    result={"error": "账号不存在"}
-                )
-                return
-            
-            # 查询场馆信息
-            venue = db.query(Venue).filter(Venue.id == booking.venue_id).first()
-            
-            if not venue:
-                print(f"[AutoBooker] 场馆不存在: {booking.venue_id}")
-                repo.update_booking_status(
-                    booking_id=booking.id, 
-                    status="failed", 
-                    result={"error": "场馆不存在"}
-                )
-                return
-            
-            # 执行预约
-            book = Booking(
-                stockid=str(venue.stockid),
-                serviceid=str(venue.serviceid),
-                id=str(venue.original_id),
-                users=booking.users,
-                username=account.username,
-                password=account.password
+            return [booking.id for booking in AutoBookingRepository(db).get_bookings_to_execute()]
+        finally:
+            db.close()
+
+    @staticmethod
+    def _pending_tasks():
+        """读取所有待执行任务的 ID 和执行时间（同步数据库操作，在线程中调用）"""
+        db = SessionLocal()
+        try:
+            return [(task.id, task.scheduled_time) for task in AutoBookingRepository(db).get_all_pending_bookings()]
+        finally:
+            db.close()
+
+    @staticmethod
+    def _account_credentials(task_id: int):
+        db = SessionLocal()
+        try:
+            booking = AutoBookingRepository(db).get_booking_by_id(task_id)
+            if not booking or booking.status != "pending" or not booking.account:
+                return None
+            return booking.account.username, booking.account.password
+        finally:
+            db.close()
+
+    @staticmethod
+    async def check_and_execute_bookings():
+        """检查并执行到期的预约任务"""
+
+        task_ids = await asyncio.to_thread(AutoBooker._due_task_ids)
+        logger.info("找到 %d 个需要执行的预约任务", len(task_ids))
+
+        await AutoBooker.fire_tasks(task_ids)
+
+    @staticmethod
+    def schedule_task(task_id: int, scheduled_time: datetime):
+        """为任务登记各阶段的精确计划，重复调用会替换旧计划（可从任意线程调用）
+
+        scheduled_time 为服务器时间，按时钟校准结果换算成请求到达服务器所需的本地发出时刻
+        """
+        scheduled_time = server_clock.to_local(scheduled_time)
+        lead = (scheduled_time - datetime.now()).total_seconds()
+        # 提前登录，执行时直接从会话池取用
+        if lead > Config.SESSION_PREWARM_AHEAD:
+            booking_scheduler.schedule_at(
+                (task_id, "prewarm"), scheduled_time - timedelta(seconds=Config.SESSION_PREWARM_AHEAD),
+                AutoBooker.prewarm_task, task_id
             )
-            
-            result = book.pre_book()
-            
-            # 更新任务状态
-            repo.update_booking_status(
-                booking_id=booking.id,
-                status="completed",
-                result=result
+        # 准备阶段：提前登录并构造请求，已进入准备窗口的任务立即准备
+        if lead > 0 and task_id not in AutoBooker._prepared:
+            booking_scheduler.schedule_at(
+                (task_id, "prepare"), scheduled_time - timedelta(seconds=min(lead, Config.PREPARE_AHEAD)),
+                AutoBooker.prepare_task, task_id
             )
-            
-            print(f"[AutoBooker] 预约成功: {booking.id}")
-            
+        # 临近触发时再访问一次预约页面，避免 keep-alive 连接因空闲被服务器关闭
+        if lead > Config.CONNECTION_WARM_AHEAD:
+            booking_scheduler.schedule_at(
+                (task_id, "warm"), scheduled_time - timedelta(seconds=Config.CONNECTION_WARM_AHEAD),
+                AutoBooker.warm_task, task_id
+            )
+        # 触发阶段：只发送预约请求，同一时刻到期的任务在同一轮事件循环中发出
+        booking_scheduler.schedule_at((task_id, "fire"), scheduled_time, AutoBooker.execute_specific_task, task_id)
+
+    @staticmethod
+    def unschedule_task(task_id: int):
+        """取消任务的所有计划并丢弃已准备的请求（任务被取消或删除时调用）"""
+        for phase in ("prewarm", "prepare", "warm", "fire"):
+            booking_scheduler.cancel((task_id, phase))
+        AutoBooker.discard_prepared(task_id)
+
+    @staticmethod
+    async def resync():
+        """从数据库同步待执行任务的计划，兜底处理未经路由创建的任务"""
+        pending_tasks = await asyncio.to_thread(AutoBooker._pending_tasks)
+        now = datetime.now()
+        for task_id, scheduled_time in pending_tasks:
+            # scheduled_time 为服务器时间，与本地时间比较前先换算
+            if server_clock.to_local(scheduled_time) > now:
+                AutoBooker.schedule_task(task_id, scheduled_time)
+        logger.info("已同步 %d 个待执行任务的执行计划", len(pending_tasks))
+
+        # 已过执行时间的任务立即执行
+        booking_scheduler.schedule_at(("sweep",), now, AutoBooker.check_and_execute_bookings)
+
+        booking_scheduler.schedule_at(
+            ("resync",), datetime.now() + timedelta(seconds=Config.SCHEDULER_RESYNC_INTERVAL), AutoBooker.resync
+        )
+
+    @staticmethod
+    async def calibrate_clock():
+        """校准服务器时钟，并按新的偏差重新安排所有任务"""
+        try:
+            await asyncio.to_thread(server_clock.calibrate)
+            await AutoBooker.resync()
         except Exception as e:
-            print(f"[AutoBooker] 预约失败: {task_id}, 错误: {str(e)}")
-            repo.update_booking_status(
-                booking_id=task_id,
-                status="failed",
-                result={"error": str(e)}
+            # 校准失败时沿用上一次的估计
+            logger.warning("服务器时钟校准失败: %s", e)
+        finally:
+            booking_scheduler.schedule_at(
+                ("calibrate",), datetime.now() + timedelta(seconds=Config.CLOCK_SYNC_INTERVAL), AutoBooker.calibrate_clock
             )
+
+    @staticmethod
+    async def prewarm_task(task_id: int):
+        """提前为任务的账号登录"""
+        credentials = await asyncio.to_thread(AutoBooker._account_credentials, task_id)
+        if credentials:
+            await asyncio.to_thread(session_pool.prewarm, [credentials])
+
+    @staticmethod
+    async def prepare_task(task_id: int):
+        """准备阶段：同一时刻准备的任务合并为一批处理"""
+        await AutoBooker._prepare_batcher.submit(task_id)
+
+    @staticmethod
+    async def prepare_tasks(task_ids: list):
+        """批量准备：一次查询数据库，再并发登录、构造请求体并建立连接"""
+        logger.info("准备预约任务 ID: %s", task_ids)
+
+        try:
+            books = await asyncio.to_thread(AutoBooker._load_tasks, task_ids)
+        except Exception as e:
+            # 准备失败不影响触发，触发阶段会重新走完整流程
+            logger.exception("任务 %s 准备失败: %s", task_ids, e)
+            return
+
+        async def prepare(task_id, book):
+            try:
+                await book.warm_up()
+            except Exception as e:
+                logger.warning("任务 %s 准备失败: %s", task_id, e, extra={"task_id": task_id})
+                return
+            with AutoBooker._lock:
+                # 准备期间任务已开始执行则不再保存
+                if task_id in AutoBooker._running:
+                    return
+                AutoBooker._prepared[task_id] = book
+            logger.info("任务 %s 准备完成", task_id, extra={"task_id": task_id})
+
+        await asyncio.gather(*(prepare(task_id, book) for task_id, book in books.items()))
+
+    @staticmethod
+    async def warm_task(task_id: int):
+        """触发前刷新已准备任务的连接"""
+        with AutoBooker._lock:
+            book = AutoBooker._prepared.get(task_id)
+        if not book:
+            return
+        try:
+            await book.warm_up()
+        except Exception as e:
+            logger.warning("任务 %s 连接预热失败: %s", task_id, e, extra={"task_id": task_id})
+
+    @staticmethod
+    async def execute_specific_task(task_id: int):
+        """触发阶段：同一时刻到期的任务合并为一批并发执行"""
+        await AutoBooker._fire_batcher.submit(task_id)
+
+    @staticmethod
+    async def fire_tasks(task_ids: list):
+        """并发触发一批任务，整批完成后一次写回结果"""
+        # 时间线以触发时刻为零点
+        origin = time.monotonic()
+        server_offset = server_clock.offset
+        logger.info("开始执行预约任务 ID: %s", task_ids)
+
+        claimed = [task_id for task_id in task_ids if AutoBooker._claim(task_id)]
+        held = set()
+        if len(claimed) < len(task_ids):
+            logger.info("任务 %s 已在执行中", sorted(set(task_ids) - set(claimed)))
+
+        try:
+            # 已准备好的任务直接发送请求，数据库读写都放到请求之后
+            books = {}
+            for task_id in claimed:
+                book = AutoBooker._take_prepared(task_id)
+                if book:
+                    books[task_id] = book
+            unprepared = [task_id for task_id in claimed if task_id not in books]
+            if unprepared:
+                books.update(await asyncio.to_thread(AutoBooker._load_tasks, unprepared))
+
+            task_order = list(books)
+            results = await asyncio.gather(
+                *(books[task_id].pre_book() for task_id in task_order),
+                return_exceptions=True
+            )
+
+            updates = []
+            attempts = []
+            for task_id, result in zip(task_order, results):
+                book = books[task_id]
+                attempts.extend(build_attempt_rows(task_id, book, origin, server_offset))
+                if isinstance(result, Exception):
+                    logger.error("预约失败: %s, 错误: %s", task_id, result,
+                                 extra={"task_id": task_id, "account": book.key[0]})
+                    updates.append((task_id, "failed", {"error": str(result)}))
+                    BOOKING_TASKS.inc(outcome="error")
+                else:
+                    logger.info("任务 %s 执行结束: %s", task_id, result["outcome"], extra={
+                        "task_id": task_id,
+                        "account": book.key[0],
+                        "venue_id": result["venue_id"],
+                        "outcome": result["outcome"],
+                        "attempts": len(result["attempts"]),
+                        "elapsed": result["elapsed"],
+                    })
+                    updates.append((task_id, "completed" if result["success"] else "failed", result))
+                    BOOKING_TASKS.inc(outcome=result["outcome"])
+
+            # 更新任务状态；写回失败的任务保持执行中，避免仍为 pending 而被兜底检查再次触发
+            if not await AutoBooker._persist_results(updates, attempts):
+                held = {task_id for task_id, _, _ in updates}
         finally:
-            db.close()
-            
+            for task_id in claimed:
+                if task_id not in held:
+                    AutoBooker._release(task_id)
+
+    @staticmethod
+    async def run():
+        """在当前事件循环中运行执行器，直到被取消"""
+        scheduler_task = asyncio.create_task(booking_scheduler.run())
+        try:
+            await AutoBooker.resync()
+            booking_scheduler.schedule_at(("calibrate",), datetime.now(), AutoBooker.calibrate_clock)
+            logger.info("自动预约执行器已启动")
+            await scheduler_task
+        finally:
+            scheduler_task.cancel()
+            await close_async_client()
+
     @staticmethod
     def start_scheduler():
-        """启动定时任务"""
-        # 首先安排精确任务
-        AutoBooker.schedule_precise_tasks()
-        
-        print("[AutoBooker] 自动预约执行器已启动")
-        
-        while True:
-            schedule.run_pending()
-            time.sleep(1)  # 每秒检查一次任务队列，提高响应速度
+        """单独运行时启动定时任务"""
+        asyncio.run(AutoBooker.run())
+
+
+# 同一轮事件循环中到期的准备和触发计划各合并为一批
+AutoBooker._prepare_batcher = _WaveBatcher(AutoBooker.prepare_tasks)
+AutoBooker._fire_batcher = _WaveBatcher(AutoBooker.fire_tasks)
+
 
 if __name__ == "__main__":
-    # 立即安排精确任务
-    AutoBooker.schedule_precise_tasks()
-    
     # 启动定时任务
-    AutoBooker.start_scheduler() 
\ No newline at end of file
+    from logging_config import setup_logging
+    setup_logging()
+    AutoBooker.start_scheduler()
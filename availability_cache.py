@@ -0,0 +1,138 @@
+"""
+场馆余量缓存
+GET /venues 按 (serviceid, date) 缓存可用场馆列表：
+- 缓存在 Config.AVAILABILITY_TTL 秒内直接返回
+- 过期后 Config.AVAILABILITY_STALE_TTL 秒内先返回旧结果，同时在后台从源系统刷新（stale-while-revalidate）
+- 同一 key 的并发未命中只向源系统请求一次，其余请求等待同一个结果（single-flight）
+- 超过 Config.AVAILABILITY_CACHE_SIZE 个 key 时淘汰最久未使用的
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# 返回给客户端的场馆字段
+VENUE_FIELDS = ("id", "original_id", "serviceid", "stockid", "date", "time_no", "sname", "status")
+
+
+def venue_to_dict(venue) -> dict:
+    return {field: getattr(venue, field) for field in VENUE_FIELDS}
+
+
+def load_available_venues(serviceid: int, date: str) -> list:
+    """从源系统刷新指定日期的场馆数据并写入数据库，返回可用场馆（同步，在线程中调用）
+
+    源系统请求失败时返回数据库中已有的数据
+    """
+    from main import SessionLocal  # 延迟导入
+    from fetch_data import FetchData, DataImporter
+    from json_stream import project_items
+    from repositories import VenueRepository
+
+    db = SessionLocal()
+    try:
+        try:
+            api_data = FetchData.fetch_service_data(date, serviceid)
+        except Exception as e:
+            logger.warning("获取 %s/%s 数据失败: %s", serviceid, date, e)
+            api_data = None
+        if api_data:
+            # 直接导入接口数据，不再写快照文件再读回；已有场馆只更新状态
+            DataImporter(db).import_items(project_items(api_data), serviceid=serviceid, date=date)
+        return [venue_to_dict(venue) for venue in VenueRepository(db).get_available_venues(serviceid, date)]
+    finally:
+        db.close()
+
+
+class _CacheEntry:
+    __slots__ = ("value", "fetched_at")
+
+    def __init__(self, value, fetched_at):
+        self.value = value
+        self.fetched_at = fetched_at
+
+
+class AvailabilityCache:
+    """TTL + LRU 缓存，只在事件循环中使用"""
+
+    def __init__(self, loader=load_available_venues, ttl: float = None, stale_ttl: float = None,
+                 max_entries: int = None, stale_while_revalidate: bool = None):
+        self.loader = loader
+        self.ttl = Config.AVAILABILITY_TTL if ttl is None else ttl
+        self.stale_ttl = Config.AVAILABILITY_STALE_TTL if stale_ttl is None else stale_ttl
+        self.max_entries = max_entries or Config.AVAILABILITY_CACHE_SIZE
+        self.stale_while_revalidate = (
+            Config.AVAILABILITY_STALE_WHILE_REVALIDATE if stale_while_revalidate is None else stale_while_revalidate
+        )
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    async def get(self, serviceid: int, date: str, refresh: bool = False) -> list:
+        """获取可用场馆，refresh 为 True 时忽略缓存"""
+        key = (serviceid, date)
+        entry = self._entries.get(key)
+        if entry is not None and not refresh:
+            self._entries.move_to_end(key)
+            age = time.monotonic() - entry.fetched_at
+            if age < self.ttl:
+                self.hits += 1
+                return entry.value
+            if self.stale_while_revalidate and age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._refresh(key)
+                return entry.value
+
+        self.misses += 1
+        return await asyncio.shield(self._refresh(key))
+
+    def _refresh(self, key) -> asyncio.Task:
+        """启动或复用 key 的刷新任务"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._load(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._refresh_done(key, t))
+        return task
+
+    def _refresh_done(self, key, task):
+        self._inflight.pop(key, None)
+        # 后台刷新没有等待者时，取出异常避免事件循环告警
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("刷新 %s 失败: %s", key, task.exception())
+
+    async def _load(self, key):
+        value = await asyncio.to_thread(self.loader, *key)
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        """写入缓存（后台轮询刷新数据后也可直接调用）"""
+        self._entries[key] = _CacheEntry(value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, serviceid: int, date: str):
+        self._entries.pop((serviceid, date), None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+        }
+
+
+# 进程内共享的场馆余量缓存
+availability_cache = AvailabilityCache()
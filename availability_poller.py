@@ -0,0 +1,105 @@
+"""
+场馆余量后台轮询
+定期从源系统刷新 Config.POLL_SERVICE_IDS 在今后 Config.POLL_DAYS_AHEAD 天的场馆状态：
+- 开放预约前后（Config.AUTO_BOOKING_TIME 附近）每 Config.POLL_INTERVAL_FAST 秒一次，其余时间每 Config.POLL_INTERVAL_SLOW 秒一次
+- 与数据库对比后只写入有变化的行，状态变化追加到 venue_status_changes，便于查看场地何时被释放或约满
+- 刷新结果同时写入 availability_cache，GET /venues 直接得到最新数据
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, time as dtime
+from config import Config
+from clock_sync import server_clock
+from availability_cache import availability_cache, venue_to_dict
+
+logger = logging.getLogger(__name__)
+
+
+class AvailabilityPoller:
+    """运行在事件循环上的轮询器，由 main.lifespan 启动"""
+
+    def __init__(self):
+        self.polls = 0
+        self.errors = 0
+        self.status_changes = 0
+        self.interval = None
+        self.last_poll = None
+
+    @staticmethod
+    def poll_dates(today=None) -> list:
+        today = today or server_clock.server_now().date()
+        return [(today + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(Config.POLL_DAYS_AHEAD)]
+
+    @staticmethod
+    def next_interval(now: datetime = None) -> float:
+        """下一次轮询前等待的秒数：开放预约前后为快速间隔，否则为慢速间隔，但不会错过快速轮询的开始"""
+        now = now or server_clock.server_now()
+        opening = datetime.combine(now.date(), dtime(*Config.AUTO_BOOKING_TIME))
+        fast_start = opening - timedelta(seconds=Config.POLL_FAST_BEFORE)
+        fast_end = opening + timedelta(seconds=Config.POLL_FAST_AFTER)
+        if fast_start <= now <= fast_end:
+            return Config.POLL_INTERVAL_FAST
+        if now > fast_end:
+            fast_start += timedelta(days=1)
+        return max(Config.POLL_INTERVAL_FAST, min(Config.POLL_INTERVAL_SLOW, (fast_start - now).total_seconds()))
+
+    @staticmethod
+    def poll_once(serviceid: int, date: str):
+        """刷新一个 (serviceid, date)，返回 (导入结果, 可用场馆)；源系统没有数据时返回 None（同步，在线程中调用）"""
+        from main import SessionLocal  # 延迟导入
+        from fetch_data import FetchData, DataImporter
+        from json_stream import project_items
+        from repositories import VenueRepository
+
+        data = FetchData.fetch_service_data(date, serviceid)
+        if not data:
+            return None
+        db = SessionLocal()
+        try:
+            stats = DataImporter(db).import_items(project_items(data), serviceid=serviceid, date=date)
+            venues = [venue_to_dict(venue) for venue in VenueRepository(db).get_available_venues(serviceid, date)]
+            return stats, venues
+        finally:
+            db.close()
+
+    async def poll(self):
+        """刷新所有轮询的 (serviceid, date)"""
+        for serviceid in Config.POLL_SERVICE_IDS:
+            for date in self.poll_dates():
+                try:
+                    result = await asyncio.to_thread(self.poll_once, serviceid, date)
+                except Exception as e:
+                    self.errors += 1
+                    logger.warning("刷新 %s/%s 失败: %s", serviceid, date, e)
+                    continue
+                if result is None:
+                    continue
+                stats, venues = result
+                availability_cache.put((serviceid, date), venues)
+                self.status_changes += stats["status_changes"]
+                if stats["status_changes"]:
+                    logger.info("%s/%s 有 %d 个场馆状态变化", serviceid, date, stats["status_changes"],
+                                extra={"serviceid": serviceid, "date": date, "status_changes": stats["status_changes"]})
+        self.polls += 1
+        self.last_poll = datetime.now()
+
+    async def run(self):
+        """持续轮询，直到被取消"""
+        logger.info("场馆余量轮询已启动")
+        while True:
+            await self.poll()
+            self.interval = self.next_interval()
+            await asyncio.sleep(self.interval)
+
+    def status(self) -> dict:
+        return {
+            "polls": self.polls,
+            "errors": self.errors,
+            "status_changes": self.status_changes,
+            "interval": self.interval,
+            "last_poll": self.last_poll,
+        }
+
+
+# 进程内共享的轮询器
+availability_poller = AvailabilityPoller()
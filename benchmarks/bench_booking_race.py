@@ -0,0 +1,210 @@
+"""
+抢约端到端基准
+启动本地上游模拟服务（upstream_simulator.py），把 Config.BASE_URL 指向它，
+为 N 个账号各创建 M 个日期的自动预约任务，所有账号争抢同一批场馆，由 AutoBooker 按开放时刻执行。
+
+输出：
+- 成功率：成功的任务数 / 任务数
+- 到达偏差：每个任务的第一个预约请求到达模拟服务的时刻减开放时刻（服务器时间），负数表示早到
+- 请求耗时：客户端记录的每次 POST 耗时及从触发到首次发出、到首个决定性响应的耗时（见 auto_booking_attempts）
+
+数据库和日志建在临时目录中，不会改动 data/reservation.db 和 logs/。
+
+用法（在仓库根目录）:
+    python benchmarks/bench_booking_race.py [--accounts 20] [--tasks 2] [--venues 10] [--lead 8] [--latency 0.03]
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from upstream_simulator import UpstreamSimulator, start_in_thread, server_url
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return round(values[max(math.ceil(p / 100 * len(values)) - 1, 0)], 3) if values else None
+
+
+def distribution(values) -> dict:
+    return {
+        "count": len(values),
+        "min": round(min(values), 3) if values else None,
+        "p50": percentile(values, 50),
+        "p99": percentile(values, 99),
+        "max": round(max(values), 3) if values else None,
+    }
+
+
+def seed_tasks(SessionLocal, sim, dates, accounts: int, venues: int, open_time: datetime) -> list:
+    """导入数据文件并创建任务：账号 i 在每个日期以第 i % venues 个场馆为主场馆，后续场馆为备选"""
+    from fetch_data import DataImporter
+    from models import Account, AutoBooking, AutoBookingCandidate, Venue
+
+    db = SessionLocal()
+    try:
+        importer = DataImporter(db)
+        for date in dates:
+            importer.import_items(sim.area("22", date), serviceid=22, date=date)
+        account_rows = [Account(username=f"bench{i:03d}", password="bench") for i in range(accounts)]
+        db.add_all(account_rows)
+        db.flush()
+
+        task_ids = []
+        for date in dates:
+            pool = db.query(Venue).filter(Venue.serviceid == 22, Venue.date == date, Venue.status == 1) \
+                .order_by(Venue.id).limit(venues).all()
+            for i, account in enumerate(account_rows):
+                ranked = [pool[(i + k) % len(pool)] for k in range(min(Config.FANOUT_WIDTH, len(pool)))]
+                booking = AutoBooking(
+                    venue_id=ranked[0].id, account_id=account.id, booking_date=date,
+                    time_no=ranked[0].time_no, users="", status="pending", scheduled_time=open_time
+                )
+                for rank, venue in enumerate(ranked[1:], start=1):
+                    booking.candidates.append(AutoBookingCandidate(venue_id=venue.id, rank=rank))
+                db.add(booking)
+                db.flush()
+                task_ids.append(booking.id)
+        db.commit()
+        return task_ids
+    finally:
+        db.close()
+
+
+async def drive(SessionLocal, task_ids: list, timeout: float):
+    """运行 AutoBooker，直到所有任务执行完毕或超时"""
+    from auto_booker import AutoBooker
+    from models import AutoBooking
+
+    def pending():
+        db = SessionLocal()
+        try:
+            return db.query(AutoBooking).filter(AutoBooking.id.in_(task_ids), AutoBooking.status == "pending").count()
+        finally:
+            db.close()
+
+    runner = asyncio.create_task(AutoBooker.run())
+    deadline = time.monotonic() + timeout
+    try:
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+            if not await asyncio.to_thread(pending):
+                break
+    finally:
+        runner.cancel()
+        try:
+            await runner
+        except asyncio.CancelledError:
+            pass
+
+
+def report(SessionLocal, sim, task_ids: list, open_at: float) -> dict:
+    from attempt_timeline import summarize
+    from models import Account, AutoBooking
+    from repositories import AutoBookingRepository
+
+    db = SessionLocal()
+    try:
+        bookings = db.query(AutoBooking).filter(AutoBooking.id.in_(task_ids)).all()
+        usernames = {account.id: account.username for account in db.query(Account).all()}
+        tasks = {(usernames[booking.account_id], booking.booking_date): booking for booking in bookings}
+        attempts = []
+        for booking in bookings:
+            attempts.extend(AutoBookingRepository(db).get_attempts(booking.id))
+        timeline = summarize(attempts)
+        statuses = {}
+        for booking in bookings:
+            statuses[booking.status] = statuses.get(booking.status, 0) + 1
+    finally:
+        db.close()
+
+    # 每个任务第一个到达服务器的请求
+    first_arrival = {}
+    for request in sim.requests:
+        key = (request["username"], request["date"])
+        if key in tasks and key not in first_arrival:
+            first_arrival[key] = request["arrived"]
+    skew = [(arrived - open_at) * 1000 for arrived in first_arrival.values()]
+    early = sum(1 for request in sim.requests if request["message"] == "未到该日期的预订时间")
+
+    return {
+        "tasks": len(task_ids),
+        "statuses": statuses,
+        "win_rate": round(statuses.get("completed", 0) / len(task_ids), 4) if task_ids else None,
+        "venues_sold": len(sim.sold),
+        "upstream_requests": len(sim.requests),
+        "early_requests": early,
+        "arrival_skew_ms": distribution(skew),
+        "post_latency_ms": timeline["post_latency_ms"],
+        "first_send_ms": timeline["first_send_ms"],
+        "first_decisive_ms": timeline["first_decisive_ms"],
+        "post_outcomes": timeline["post_outcomes"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="抢约端到端基准")
+    parser.add_argument("--accounts", type=int, default=20, help="账号数 N")
+    parser.add_argument("--tasks", type=int, default=2, help="每个账号的任务数 M（不同日期）")
+    parser.add_argument("--venues", type=int, default=10, help="每个日期被争抢的场馆数")
+    parser.add_argument("--lead", type=float, default=8, help="多少秒后开放预约")
+    parser.add_argument("--latency", type=float, default=0.03, help="模拟服务每个请求的基础耗时（秒）")
+    parser.add_argument("--jitter", type=float, default=0.02, help="模拟服务随机附加耗时的上限（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="预约请求返回 502 的概率")
+    parser.add_argument("--clock-offset", type=float, default=0.0, help="模拟服务器时钟比本地快的秒数")
+    parser.add_argument("--deadline", type=float, default=5, help="单次预约的重试截止时间（秒）")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_race_")
+    Config.DB_URL = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    Config.LOG_FILE = os.path.join(workdir, "app.log")
+    Config.LOG_CONSOLE = False
+    Config.RETRY_DEADLINE = args.deadline
+
+    sim = UpstreamSimulator(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            clock_offset=args.clock_offset, seed=args.seed)
+    dates = sorted(date for serviceid, date in sim.areas if serviceid == "22")[:args.tasks]
+    if len(dates) < args.tasks:
+        sys.exit(f"data/ 中只有 {len(dates)} 个 serviceid=22 的日期")
+    server = start_in_thread(sim)
+    Config.BASE_URL = server_url(server)
+
+    # 开放时刻为服务器时间，取整秒，任务的 scheduled_time 与之相同
+    open_at = math.ceil(sim.server_time() + args.lead)
+    sim.open_at = open_at
+    open_time = datetime.fromtimestamp(open_at)
+
+    # 导入 main 时按上面的 Config 建库并配置日志
+    from main import SessionLocal
+    task_ids = seed_tasks(SessionLocal, sim, dates, args.accounts, args.venues, open_time)
+    asyncio.run(drive(SessionLocal, task_ids, timeout=args.lead + args.deadline + 30))
+    server.should_exit = True
+
+    result = {
+        "config": {
+            "accounts": args.accounts,
+            "tasks_per_account": args.tasks,
+            "venues_per_date": args.venues,
+            "fanout_width": Config.FANOUT_WIDTH,
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "error_rate": args.error_rate,
+            "clock_offset": args.clock_offset,
+        },
+        **report(SessionLocal, sim, task_ids, open_at),
+        "workdir": workdir,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+事件循环阻塞基准
+在一个预约请求进行中（上游每次预约耗时 --upstream-delay 秒）交替读取 /venues 和 /accounts，统计读取延迟，
+结束时输出数据库连接池状态（借出的连接数应回到 0）。
+路由阻塞事件循环时，读取延迟会接近上游耗时；不阻塞时应保持在毫秒级。
+
+上游是本地的 HTTP 服务，不会访问真实的预约系统；应用只挂载路由，不启动自动预约执行器和后台轮询。
+
+用法（在仓库根目录）: python benchmarks/bench_event_loop.py [--reads 200] [--upstream-delay 2]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+from config import Config
+
+
+def start_upstream(delay: float) -> ThreadingHTTPServer:
+    """本地模拟上游：登录和页面立即返回，预约请求等待 delay 秒后返回成功"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, body, content_type="application/json"):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.startswith("/cgyd/product/findOkArea.html"):
+                self._reply(404, "{}")
+            else:
+                self._reply(200, "<html></html>", "text/html")
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if self.path.startswith("/cgyd/order/tobook.html"):
+                time.sleep(delay)
+                self._reply(200, json.dumps({"result": "1", "message": "预约成功"}, ensure_ascii=False))
+            else:
+                self.send_response(200)
+                self.send_header("Set-Cookie", "JSESSIONID=bench; Path=/")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_app(port: int) -> uvicorn.Server:
+    from routers import router
+    app = FastAPI()
+    app.include_router(router, prefix="/api/v1")
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+    }
+
+
+async def run(base: str, reads: int):
+    async with httpx.AsyncClient(base_url=base, timeout=60) as client:
+        venue_params = {"serviceid": 42, "date": "2024-04-25"}
+        # 先填充 /venues 缓存，之后的读取不再访问上游
+        await client.get("/venues", params=venue_params)
+
+        prebook_params = {
+            "stockid": "1", "serviceid": "42", "venue_id": "1", "users": "",
+            "username": "bench", "password": "bench",
+        }
+        started = time.perf_counter()
+        prebook = asyncio.create_task(client.post("/prebook", params=prebook_params))
+        await asyncio.sleep(0.2)
+
+        async def timed(path, params=None):
+            t = time.perf_counter()
+            response = await client.get(path, params=params)
+            response.raise_for_status()
+            return time.perf_counter() - t
+
+        results = {"/venues": [], "/accounts": []}
+        for _ in range(reads):
+            if prebook.done():
+                break
+            results["/venues"].append(await timed("/venues", venue_params))
+            results["/accounts"].append(await timed("/accounts"))
+
+        response = await prebook
+        prebook_seconds = round(time.perf_counter() - started, 3)
+        pool = (await client.get("/debug/pool")).json()
+        return {
+            "prebook_status": response.json().get("status"),
+            "prebook_seconds": prebook_seconds,
+            **{path: summarize(values) for path, values in results.items() if values},
+            "pool": pool,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预约进行中的读取延迟")
+    parser.add_argument("--reads", type=int, default=200)
+    parser.add_argument("--upstream-delay", type=float, default=2.0)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    upstream = start_upstream(args.upstream_delay)
+    Config.BASE_URL = f"http://127.0.0.1:{upstream.server_address[1]}"
+    server = start_app(args.port)
+    try:
+        result = asyncio.run(run(f"http://127.0.0.1:{args.port}/api/v1", args.reads))
+    finally:
+        server.should_exit = True
+        upstream.shutdown()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+SQLite 写入争用基准
+模拟 08:00 的集中写回：多个写线程各自逐个提交任务状态，同时多个读线程持续查询任务列表和可用场馆。
+分别在 rollback 日志（DELETE）和 WAL 模式下运行，比较读写延迟和 database is locked 错误数。
+
+数据库建在临时目录中，不会改动 data/reservation.db。
+
+用法（在仓库根目录）: python benchmarks/bench_sqlite_contention.py [--tasks 400] [--writers 8] [--readers 4]
+"""
+import argparse
+import json
+import os
+import queue
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from database import create_db_engine
+from models import Base, Account, Venue, AutoBooking
+from repositories import AutoBookingRepository, VenueRepository
+
+
+def seed(SessionLocal, tasks: int):
+    db = SessionLocal()
+    try:
+        db.add(Account(id=1, username="bench", password="bench"))
+        for i in range(1, 201):
+            db.add(Venue(id=i, original_id=i, serviceid=22, stockid=i, date="2030-01-01",
+                         time_no="08:01-09:00", sname=f"场地{i}", status=1))
+        for i in range(1, tasks + 1):
+            db.add(AutoBooking(id=i, venue_id=(i % 200) + 1, account_id=1, booking_date="2030-01-01",
+                               time_no="08:01-09:00", users="", status="pending",
+                               scheduled_time=datetime(2030, 1, 1, 8, 0, 5)))
+        db.commit()
+    finally:
+        db.close()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return round(values[max(0, int(len(values) * p) - 1)] * 1000, 2) if values else None
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50_ms": round(statistics.median(values) * 1000, 2) if values else None,
+        "p99_ms": percentile(values, 0.99),
+        "max_ms": round(max(values) * 1000, 2) if values else None,
+    }
+
+
+def run_mode(journal_mode: str, tasks: int, writers: int, readers: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_db_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", journal_mode=journal_mode)
+        Base.metadata.create_all(bind=engine)
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        seed(SessionLocal, tasks)
+
+        pending = queue.Queue()
+        for task_id in range(1, tasks + 1):
+            pending.put(task_id)
+        done = threading.Event()
+        lock = threading.Lock()
+        write_latencies, read_latencies, errors = [], [], []
+
+        def writer():
+            db = SessionLocal()
+            try:
+                while True:
+                    try:
+                        task_id = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    started = time.perf_counter()
+                    try:
+                        AutoBookingRepository(db).bulk_update_status(
+                            [(task_id, "completed", {"success": True, "message": "预约成功"})]
+                        )
+                    except OperationalError as e:
+                        db.rollback()
+                        with lock:
+                            errors.append(str(e.orig))
+                        continue
+                    with lock:
+                        write_latencies.append(time.perf_counter() - started)
+            finally:
+                db.close()
+
+        def reader():
+            db = SessionLocal()
+            try:
+                while not done.is_set():
+                    started = time.perf_counter()
+                    try:
+                        AutoBookingRepository(db).get_bookings(limit=50)
+                        VenueRepository(db).get_available_venues(22, "2030-01-01")
+                        db.rollback()
+                    except OperationalError as e:
+                        db.rollback()
+                        with lock:
+                            errors.append(str(e.orig))
+                        continue
+                    with lock:
+                        read_latencies.append(time.perf_counter() - started)
+            finally:
+                db.close()
+
+        reader_threads = [threading.Thread(target=reader) for _ in range(readers)]
+        writer_threads = [threading.Thread(target=writer) for _ in range(writers)]
+        for thread in reader_threads:
+            thread.start()
+        started = time.perf_counter()
+        for thread in writer_threads:
+            thread.start()
+        for thread in writer_threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        done.set()
+        for thread in reader_threads:
+            thread.join()
+        engine.dispose()
+
+        return {
+            "journal_mode": journal_mode,
+            "burst_seconds": round(elapsed, 3),
+            "writes_per_second": round(len(write_latencies) / elapsed, 1),
+            "writes": summarize(write_latencies),
+            "reads": summarize(read_latencies),
+            "errors": len(errors),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite 日志模式争用对比")
+    parser.add_argument("--tasks", type=int, default=400)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--modes", default="DELETE,WAL")
+    args = parser.parse_args()
+
+    results = [run_mode(mode, args.tasks, args.writers, args.readers) for mode in args.modes.split(",")]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+"""
+微基准套件
+依次测量以下各项，并把结果写成 JSON，便于比较两次运行：
+- import: DataImporter.import_from_json 导入 data/service_data_*.json* 的吞吐量，以及放大 10×/100× 的合成数据
+  （首次导入为插入，再次导入为全部跳过）
+- queries: VenueRepository.get_available_venues 和 AutoBookingRepository.get_bookings_to_execute
+  在 venues / auto_bookings 各有 1万/10万/100万行时的耗时
+- api: 通过进程内 ASGI 客户端并发请求 /api/v1/venues（缓存命中）和 /api/v1/auto-bookings 的每秒请求数
+- startup: 新进程中导入 main、进入 lifespan 以及启动导入完成（/health 就绪）的耗时，首次启动和数据文件未变化时分别测量
+
+数据库、日志和数据文件副本都建在临时目录中，不会改动 data/ 和 logs/；/venues 的上游是本地模拟服务。
+
+用法（在仓库根目录）:
+    python benchmarks/bench_suite.py [--sizes 10000,100000,1000000] [--inflate 10,100] [--quick]
+    python benchmarks/bench_suite.py --compare benchmarks/results/上一次.json
+"""
+import argparse
+import asyncio
+import glob
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+from config import Config
+
+DATA_FILES = sorted(glob.glob(os.path.join(REPO, "data", "service_data_*.json*")))
+SEED_CHUNK = 50000
+VENUES_PER_DATE = 200
+DUE_TASKS = 100
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)] if values else None
+
+
+def timings(seconds: list) -> dict:
+    """耗时列表（秒）的汇总（毫秒）"""
+    ms = [s * 1000 for s in seconds]
+    return {
+        "runs": len(ms),
+        "mean_ms": round(statistics.mean(ms), 3),
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+    }
+
+
+def new_session_factory(path: str):
+    from database import create_db_engine
+    from migrations import upgrade
+    engine = create_db_engine(f"sqlite:///{path}")
+    upgrade(engine)
+    return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+# ---- import ----
+
+def inflate(src: str, dst: str, factor: int) -> int:
+    """把数据文件中的条目复制 factor 份（id 和 stockid 错开），写成同样格式的文件"""
+    from json_stream import iter_venue_items, write_venue_items
+    items = list(iter_venue_items(src))
+
+    def copies():
+        for k in range(factor):
+            for item in items:
+                item = dict(item)
+                item["id"] = int(item["id"]) + k * 10_000_000
+                item["stockid"] = int(str(item["stockid"]).strip()) + k * 10_000_000
+                yield item
+
+    return write_venue_items(dst, copies())
+
+
+def import_files(workdir: str, name: str, files: list) -> dict:
+    from fetch_data import DataImporter
+    engine, SessionLocal = new_session_factory(os.path.join(workdir, f"import_{name}.db"))
+    result = {"files": len(files), "bytes": sum(os.path.getsize(path) for path in files)}
+    try:
+        for phase in ("insert", "reimport"):
+            db = SessionLocal()
+            try:
+                importer = DataImporter(db)
+                started = time.perf_counter()
+                stats = [importer.import_from_json(path) for path in files]
+                elapsed = time.perf_counter() - started
+            finally:
+                db.close()
+            rows = sum(s["valid"] for s in stats)
+            result[phase] = {
+                "rows": rows,
+                "inserted": sum(s["inserted"] for s in stats),
+                "updated": sum(s["updated"] for s in stats),
+                "skipped": sum(s["skipped"] for s in stats),
+                "seconds": round(elapsed, 4),
+                "rows_per_second": round(rows / elapsed, 1) if elapsed else None,
+            }
+    finally:
+        engine.dispose()
+    return result
+
+
+def bench_import(workdir: str, factors: list) -> dict:
+    results = {"real": import_files(workdir, "real", DATA_FILES)}
+    for factor in factors:
+        folder = os.path.join(workdir, f"inflated_{factor}x")
+        os.makedirs(folder, exist_ok=True)
+        files = []
+        for src in DATA_FILES:
+            dst = os.path.join(folder, os.path.basename(src))
+            inflate(src, dst, factor)
+            files.append(dst)
+        results[f"{factor}x"] = import_files(workdir, f"{factor}x", files)
+        shutil.rmtree(folder)
+    return results
+
+
+# ---- queries ----
+
+def seed_rows(SessionLocal, rows: int) -> str:
+    """写入 rows 行场馆和 rows 行任务（其中 DUE_TASKS 个已到期待执行），返回用于查询的日期"""
+    from models import Account, AutoBooking, Venue
+    base = datetime(2030, 1, 1)
+    now = datetime.now()
+    db = SessionLocal()
+    try:
+        db.add(Account(id=1, username="bench", password="bench"))
+        db.flush()
+        for start in range(0, rows, SEED_CHUNK):
+            chunk = range(start, min(start + SEED_CHUNK, rows))
+            db.execute(insert(Venue), [{
+                "id": i + 1,
+                "original_id": i + 1,
+                "serviceid": 22,
+                "stockid": i + 1,
+                "date": (base + timedelta(days=i // VENUES_PER_DATE)).strftime("%Y-%m-%d"),
+                "time_no": f"{8 + i % 14:02d}:01-{9 + i % 14:02d}:00",
+                "sname": f"场地{i % VENUES_PER_DATE + 1}",
+                "status": 1 if i % 3 else 0,
+            } for i in chunk])
+            db.execute(insert(AutoBooking), [{
+                "id": i + 1,
+                "venue_id": i + 1,
+                "account_id": 1,
+                "booking_date": (base + timedelta(days=i // VENUES_PER_DATE)).strftime("%Y-%m-%d"),
+                "time_no": "08:01-09:00",
+                "users": "",
+                # 少量到期和未到期的待执行任务，其余为历史任务
+                "status": "pending" if i < 2 * DUE_TASKS else ("completed" if i % 2 else "failed"),
+                "scheduled_time": now - timedelta(minutes=1) if i < DUE_TASKS
+                else now + timedelta(days=1) if i < 2 * DUE_TASKS
+                else now - timedelta(minutes=i),
+                "created_at": now,
+            } for i in chunk])
+        db.commit()
+    finally:
+        db.close()
+    return (base + timedelta(days=(rows // VENUES_PER_DATE) // 2)).strftime("%Y-%m-%d")
+
+
+def time_query(SessionLocal, query, repeat: int):
+    """每次使用新的会话（与请求级会话一致），返回 (耗时列表, 返回行数)"""
+    seconds, count = [], None
+    for _ in range(repeat):
+        db = SessionLocal()
+        try:
+            started = time.perf_counter()
+            count = len(query(db))
+            seconds.append(time.perf_counter() - started)
+        finally:
+            db.close()
+    return seconds, count
+
+
+def bench_queries(workdir: str, sizes: list, repeat: int) -> dict:
+    from repositories import AutoBookingRepository, VenueRepository
+    results = {}
+    for rows in sizes:
+        path = os.path.join(workdir, f"queries_{rows}.db")
+        engine, SessionLocal = new_session_factory(path)
+        try:
+            started = time.perf_counter()
+            date = seed_rows(SessionLocal, rows)
+            seeded = time.perf_counter() - started
+
+            venues, venue_count = time_query(
+                SessionLocal, lambda db: VenueRepository(db).get_available_venues(22, date), repeat)
+            due, due_count = time_query(
+                SessionLocal, lambda db: AutoBookingRepository(db).get_bookings_to_execute(), repeat)
+            results[str(rows)] = {
+                "seed_seconds": round(seeded, 2),
+                "get_available_venues": {"rows_returned": venue_count, **timings(venues)},
+                "get_bookings_to_execute": {"rows_returned": due_count, **timings(due)},
+            }
+        finally:
+            engine.dispose()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    return results
+
+
+# ---- api ----
+
+async def request_rate(client, url: str, total: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.get(url)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+
+    for _ in range(min(20, total)):
+        await one()
+    latencies.clear()
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "requests_per_second": round(total / elapsed, 1),
+        **timings(latencies),
+    }
+
+
+def bench_api(workdir: str, rows: int, total: int, concurrency: int) -> dict:
+    import httpx
+    from upstream_simulator import UpstreamSimulator, start_in_thread, server_url
+
+    sim = UpstreamSimulator(data_dir=os.path.join(REPO, "data"), latency=0, jitter=0)
+    server = start_in_thread(sim)
+    Config.BASE_URL = server_url(server)
+    Config.DB_URL = f"sqlite:///{os.path.join(workdir, 'api.db')}"
+    serviceid, date = sorted(key for key in sim.areas if key[0] == "22")[0]
+
+    # 导入 main 时按上面的 Config 建库；不进入 lifespan，不启动执行器和后台轮询
+    import main
+    seed_rows(main.SessionLocal, rows)
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return {
+                "venues": await request_rate(
+                    client, f"/api/v1/venues?serviceid={serviceid}&date={date}", total, concurrency),
+                "auto_bookings": await request_rate(client, "/api/v1/auto-bookings", total, concurrency),
+            }
+
+    try:
+        return {"rows": rows, **asyncio.run(run())}
+    finally:
+        server.should_exit = True
+
+
+# ---- startup ----
+
+STARTUP_SCRIPT = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {repo!r})
+from config import Config
+Config.DB_URL = {db_url!r}
+Config.LOG_FILE = {log_file!r}
+Config.LOG_CONSOLE = False
+import main
+imported = time.perf_counter()
+
+async def run():
+    async with main.app.router.lifespan_context(main.app):
+        entered = time.perf_counter()
+        while not main.import_status["ready"]:
+            await asyncio.sleep(0.005)
+        return entered, time.perf_counter(), dict(main.import_status)
+
+entered, ready, status = asyncio.run(run())
+print(json.dumps({{"import_seconds": imported - started, "lifespan_seconds": entered - started,
+                   "ready_seconds": ready - started, "files_imported": status["imported"]}}))
+"""
+
+
+def start_once(folder: str) -> dict:
+    script = STARTUP_SCRIPT.format(
+        repo=REPO,
+        db_url=f"sqlite:///{os.path.join(folder, 'startup.db')}",
+        log_file=os.path.join(folder, "app.log"),
+    )
+    # 上游指向不可连接的本地端口，时钟校准和后台轮询立即失败，不访问真实系统
+    env = dict(os.environ, ORDER_BASE_URL="http://127.0.0.1:9")
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", script], cwd=folder, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_seconds"] = time.perf_counter() - started
+    return result
+
+
+def bench_startup(workdir: str, runs: int) -> dict:
+    folder = os.path.join(workdir, "startup")
+    os.makedirs(os.path.join(folder, "data"))
+    for path in DATA_FILES:
+        shutil.copy2(path, os.path.join(folder, "data"))
+
+    def summary(samples):
+        return {
+            key: round(statistics.median(sample[key] for sample in samples), 4)
+            for key in ("import_seconds", "lifespan_seconds", "ready_seconds", "process_seconds", "files_imported")
+        }
+
+    cold = start_once(folder)
+    warm = [start_once(folder) for _ in range(runs)]
+    return {"cold": summary([cold]), "warm": {"runs": runs, **summary(warm)}}
+
+
+# ---- compare ----
+
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def compare(old: dict, new: dict):
+    """逐项打印数值变化，跳过 meta"""
+    old_values = dict(flatten({k: v for k, v in old.items() if k != "meta"}))
+    for key, value in flatten({k: v for k, v in new.items() if k != "meta"}):
+        if key not in old_values:
+            continue
+        before = old_values[key]
+        ratio = f"x{value / before:.2f}" if before else "-"
+        print(f"{key}: {before} -> {value} ({ratio})")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="微基准套件")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="queries 的行数，逗号分隔")
+    parser.add_argument("--inflate", default="10,100", help="导入数据的放大倍数，逗号分隔")
+    parser.add_argument("--repeat", type=int, default=30, help="每个查询重复次数")
+    parser.add_argument("--api-rows", type=int, default=10000, help="api 测试数据库的行数")
+    parser.add_argument("--requests", type=int, default=1000, help="每个接口的请求数")
+    parser.add_argument("--concurrency", type=int, default=10, help="并发请求数")
+    parser.add_argument("--startup-runs", type=int, default=3, help="数据文件未变化时的启动次数")
+    parser.add_argument("--only", default="import,queries,api,startup", help="只运行这些部分，逗号分隔")
+    parser.add_argument("--quick", action="store_true", help="小规模快速运行：1万行、放大 10×、200 个请求")
+    parser.add_argument("--output", help="结果文件，默认为 benchmarks/results/bench_suite_<时间>.json")
+    parser.add_argument("--compare", help="与之前的结果文件比较")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.sizes, args.inflate, args.requests, args.repeat, args.startup_runs = "10000", "10", 200, 10, 1
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    factors = [int(factor) for factor in args.inflate.split(",") if factor]
+    parts = set(args.only.split(","))
+
+    workdir = tempfile.mkdtemp(prefix="bench_suite_")
+    Config.LOG_FILE = os.path.join(workdir, "app.log")
+    Config.LOG_CONSOLE = False
+    # availability_cache 会把上游数据保存到当前目录的 data/，在临时目录中运行
+    os.chdir(workdir)
+
+    result = {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        }
+    }
+    try:
+        if "import" in parts:
+            result["import"] = bench_import(workdir, factors)
+        if "queries" in parts:
+            result["queries"] = bench_queries(workdir, sizes, args.repeat)
+        if "startup" in parts:
+            result["startup"] = bench_startup(workdir, args.startup_runs)
+        if "api" in parts:
+            result["api"] = bench_api(workdir, args.api_rows, args.requests, args.concurrency)
+    finally:
+        os.chdir(REPO)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(
+        REPO, "benchmarks", "results", f"bench_suite_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f"结果已写入 {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+本地上游模拟服务
+模拟预约系统的登录、预约页面、余量查询和预约接口，用于在不访问 order.njmu.edu.cn 的情况下测量 08:00 的抢约：
+- /cgyd/login.html: POST 登录后下发会话 Cookie，GET 返回登录页（时钟校准读取其 Date 头）
+- /cgyd/product/show.html: 预约页面，会话无效时重定向到登录页
+- /cgyd/product/findOkArea.html: 按 data/ 中的数据文件返回场馆，已被预约的场馆状态为 0
+- /cgyd/order/tobook.html: 开放前返回“未到该日期的预订时间”，同一账号同一日期只能成功一次（“每日限预约一场”），
+  每个场馆先到先得
+
+每个请求耗时为 latency 加随机抖动，预约请求在处理前后各等待一半，按到达服务器的时刻决定先后；Date 头按模拟的服务器时钟（本地时钟 + clock_offset）生成。
+
+用法（在仓库根目录）:
+    python benchmarks/upstream_simulator.py [--port 8088] [--latency 0.03] [--jitter 0.02] [--error-rate 0.01]
+然后以 ORDER_BASE_URL=http://127.0.0.1:8088 启动应用
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from email.utils import formatdate
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response
+from starlette.requests import ClientDisconnect
+from config import Config
+from json_stream import iter_venue_items
+
+NOT_OPEN_MESSAGE = '未到该日期的预订时间'
+DAILY_LIMIT_MESSAGE = '每日限预约一场'
+TAKEN_MESSAGE = '该场地已被预约'
+SUCCESS_MESSAGE = '预约成功'
+
+SESSION_COOKIE = "JSESSIONID"
+
+
+class UpstreamSimulator:
+    """模拟服务的状态：场馆、会话、已售出的场馆和每次预约请求的记录"""
+
+    def __init__(self, data_dir: str = "data", latency: float = 0.03, jitter: float = 0.02,
+                 error_rate: float = 0.0, login_latency: float = None, clock_offset: float = 0.0,
+                 open_at: float = None, seed: int = None):
+        """latency、jitter 为秒；clock_offset 为服务器时钟减本地时钟的秒数；
+        open_at 为所有日期统一的开放时刻（服务器时间的时间戳），为空时按预约日前一天的 Config.AUTO_BOOKING_TIME 的整分钟开放
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.login_latency = latency if login_latency is None else login_latency
+        self.clock_offset = clock_offset
+        self.open_at = open_at
+        self.random = random.Random(seed)
+        self.venues = {}      # 场馆 id -> 数据文件中的条目
+        self.areas = {}       # (serviceid, date) -> [场馆 id]
+        self.sessions = {}    # Cookie -> 账号
+        self.sold = {}        # 场馆 id -> 账号
+        self.won = set()      # (账号, 日期)
+        self.requests = []    # 每次预约请求的记录
+        self._lock = threading.Lock()
+        self.load(data_dir)
+
+    def load(self, data_dir: str):
+        for path in sorted(glob.glob(os.path.join(data_dir, "service_data_*.json*"))):
+            for item in iter_venue_items(path):
+                stock = item.get("stock") or {}
+                key = (str(stock.get("serviceid")), stock.get("s_date"))
+                self.venues[int(item["id"])] = item
+                self.areas.setdefault(key, []).append(int(item["id"]))
+
+    def server_time(self) -> float:
+        return time.time() + self.clock_offset
+
+    def opens_at(self, date: str) -> float:
+        if self.open_at is not None:
+            return self.open_at
+        hour, minute = Config.AUTO_BOOKING_TIME[:2]
+        day = datetime.strptime(date, "%Y-%m-%d") - timedelta(days=1)
+        return day.replace(hour=hour, minute=minute).timestamp()
+
+    def reset(self):
+        with self._lock:
+            self.sold.clear()
+            self.won.clear()
+            self.requests.clear()
+
+    async def delay(self, base: float):
+        """等待 base 秒加随机抖动"""
+        wait = base + self.random.uniform(0, self.jitter)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def login(self, username: str) -> str:
+        token = secrets.token_hex(16)
+        with self._lock:
+            self.sessions[token] = username
+        return token
+
+    def area(self, serviceid: str, date: str) -> list:
+        items = []
+        for venue_id in self.areas.get((str(serviceid), date), []):
+            item = dict(self.venues[venue_id])
+            if venue_id in self.sold:
+                item["status"] = 0
+            items.append(item)
+        return items
+
+    def book(self, username: str, venue_id: int) -> dict:
+        """在到达服务器的时刻按先到先得处理一次预约"""
+        arrived = self.server_time()
+        item = self.venues.get(venue_id)
+        with self._lock:
+            if item is None:
+                result, message = 0, "场地不存在"
+            else:
+                date = item["stock"]["s_date"]
+                if arrived < self.opens_at(date):
+                    result, message = 0, NOT_OPEN_MESSAGE
+                elif (username, date) in self.won:
+                    result, message = 0, DAILY_LIMIT_MESSAGE
+                elif venue_id in self.sold or item.get("status") != 1:
+                    result, message = 0, TAKEN_MESSAGE
+                else:
+                    self.sold[venue_id] = username
+                    self.won.add((username, date))
+                    result, message = 1, SUCCESS_MESSAGE
+            self.requests.append({
+                "username": username,
+                "venue_id": venue_id,
+                "date": item["stock"]["s_date"] if item else None,
+                "arrived": arrived,
+                "result": result,
+                "message": message,
+            })
+        return {"result": str(result), "message": message}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "venues": len(self.venues),
+                "sessions": len(self.sessions),
+                "sold": len(self.sold),
+                "requests": len(self.requests),
+            }
+
+
+def create_app(sim: UpstreamSimulator) -> FastAPI:
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def server_clock(request: Request, call_next):
+        response = await call_next(request)
+        # 运行时需关闭 uvicorn 自带的 Date 头（date_header=False）
+        response.headers["Date"] = formatdate(sim.server_time(), usegmt=True)
+        return response
+
+    async def read_form(request: Request):
+        """读取表单，客户端已断开（请求被取消）时返回 None"""
+        try:
+            return parse_qs((await request.body()).decode("utf-8"))
+        except ClientDisconnect:
+            return None
+
+    def session_user(request: Request):
+        return sim.sessions.get(request.cookies.get(SESSION_COOKIE))
+
+    @app.get("/cgyd/login.html")
+    async def login_page():
+        return HTMLResponse("<html><body>login</body></html>")
+
+    @app.post("/cgyd/login.html")
+    async def login(request: Request):
+        form = await read_form(request)
+        if form is None:
+            return Response(status_code=400)
+        username = (form.get("dlm") or [""])[0]
+        await sim.delay(sim.login_latency)
+        if not username or not (form.get("mm") or [""])[0]:
+            return HTMLResponse("<html><body>登录失败</body></html>", status_code=401)
+        response = HTMLResponse("<html><body>ok</body></html>")
+        response.set_cookie(SESSION_COOKIE, sim.login(username), path="/")
+        return response
+
+    @app.get("/cgyd/product/show.html")
+    async def show(request: Request):
+        await sim.delay(sim.latency)
+        if session_user(request) is None:
+            return RedirectResponse("/cgyd/login.html", status_code=302)
+        return HTMLResponse("<html><body>show</body></html>")
+
+    @app.get("/cgyd/product/findOkArea.html")
+    async def find_ok_area(s_date: str, serviceid: str):
+        await sim.delay(sim.latency)
+        return JSONResponse({"object": sim.area(serviceid, s_date)})
+
+    @app.post("/cgyd/order/tobook.html")
+    async def tobook(request: Request):
+        form = await read_form(request)
+        if form is None:
+            return Response(status_code=400)
+        username = session_user(request)
+        wait = (sim.latency + sim.random.uniform(0, sim.jitter)) / 2
+        await asyncio.sleep(wait)
+        if username is None:
+            return RedirectResponse("/cgyd/login.html", status_code=302)
+        if sim.random.random() < sim.error_rate:
+            await asyncio.sleep(wait)
+            return JSONResponse({"message": "系统繁忙"}, status_code=502)
+        try:
+            param = json.loads(form["param"][0])
+            venue_id = int(next(iter(param["stockdetail"].values())))
+        except (KeyError, ValueError, StopIteration):
+            return JSONResponse({"result": "0", "message": "参数错误"})
+        result = sim.book(username, venue_id)
+        await asyncio.sleep(wait)
+        return JSONResponse(result)
+
+    @app.get("/sim/stats")
+    async def stats():
+        return sim.stats()
+
+    @app.post("/sim/reset")
+    async def reset():
+        sim.reset()
+        return sim.stats()
+
+    return app
+
+
+def start_in_thread(sim: UpstreamSimulator, host: str = "127.0.0.1", port: int = 0) -> uvicorn.Server:
+    """在后台线程中启动模拟服务，返回的 server.servers[0] 可取得实际端口"""
+    server = uvicorn.Server(uvicorn.Config(
+        create_app(sim), host=host, port=port, log_level="warning", date_header=False
+    ))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def server_url(server: uvicorn.Server) -> str:
+    host, port = server.servers[0].sockets[0].getsockname()[:2]
+    return f"http://{host}:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地上游模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--latency", type=float, default=0.03, help="每个请求的基础耗时（秒）")
+    parser.add_argument("--jitter", type=float, default=0.02, help="随机附加耗时的上限（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="预约请求返回 502 的概率")
+    parser.add_argument("--login-latency", type=float, default=None, help="登录耗时（秒），默认同 --latency")
+    parser.add_argument("--clock-offset", type=float, default=0.0, help="服务器时钟比本地快的秒数")
+    parser.add_argument("--open-in", type=float, default=None,
+                        help="多少秒后对所有日期开放预约，默认按预约日前一天的 Config.AUTO_BOOKING_TIME")
+    args = parser.parse_args()
+
+    sim = UpstreamSimulator(
+        data_dir=args.data_dir, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        login_latency=args.login_latency, clock_offset=args.clock_offset,
+        open_at=None if args.open_in is None else time.time() + args.clock_offset + args.open_in
+    )
+    print(f"已加载 {len(sim.venues)} 个场馆，监听 http://{args.host}:{args.port}")
+    uvicorn.run(create_app(sim), host=args.host, port=args.port, log_level="warning", date_header=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,31 @@
 # book.py
 import json
+import logging
 
 import requests
 from urllib.parse import urlencode
 from config import Config
-from login import Login
+from metrics import BOOKING_REQUEST_SECONDS, BOOKING_REQUESTS_IN_FLIGHT
+from session_pool import session_pool, is_session_rejected
+from retry_engine import RetryEngine, RetryPolicy, RetryableError
 
-global cnt
-cnt = 0
-BASE_URL = 'http://order.njmu.edu.cn:8088'
+logger = logging.getLogger(__name__)
 
 class Booking:
-    def __init__(self, stockid='', serviceid='', id='', users='', username='', password=''):
+    def __init__(self, stockid='', serviceid='', id='', users='', username='', password='', retry_policy=None):
         self.stockid = stockid
         self.serviceid = serviceid
         self.id = id
         self.users = users
         self.username = username
         self.password = password
+        self.retry_policy = retry_policy or RetryPolicy()
+        # 附加到本次预约所有日志的字段
+        self.log_context = {"account": username, "stockid": stockid}
         if username and password:
-            login = Login(username, password)
-            self.session = login.pre_login()
-            self.book_url = f"{BASE_URL}/cgyd/order/tobook.html"
+            # 从会话池取出已登录的会话，同一账号的多个任务复用同一连接
+            self.session = session_pool.checkout(username, password)
+            self.book_url = f"{Config.BASE_URL}/cgyd/order/tobook.html"
             self.payload = {
                 "param": {
                     "stockdetail": {str(self.stockid): str(self.id)},
@@ -44,99 +48,55 @@ class Booking:
             self.headers = {
                 "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
                 "X-Requested-With": "XMLHttpRequest",
-                "Referer": f"{BASE_URL}/cgyd/product/show.html?id={self.serviceid}"
+                "Referer": f"{Config.BASE_URL}/cgyd/product/show.html?id={self.serviceid}"
             }
 
-    def pre_book(self):
-        global cnt
-        if cnt == 50:
-            return
-        # 准备预约请求数据 (将其 URL 编码)
+    def _send(self):
+        """发送一次预约请求，返回服务器的 JSON 结果"""
+        try:
+            with BOOKING_REQUESTS_IN_FLIGHT.track_inprogress(), BOOKING_REQUEST_SECONDS.time(client="sync"):
+                response = self.session.post(self.book_url, data=self.encoded_payload, headers=self.headers,
+                                             timeout=Config.REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            raise RetryableError(f"请求异常: {str(e)}")
+        # 会话被服务器拒绝时，使其失效并重新登录
+        if is_session_rejected(response):
+            logger.info("会话已失效，重新登录", extra=self.log_context)
+            session_pool.invalidate(self.username, self.session)
+            self.session = session_pool.checkout(self.username, self.password)
+            raise RetryableError("会话已失效")
+        if response.status_code != 200:
+            logger.warning("请求失败，状态码: %s", response.status_code, extra=self.log_context)
+            raise RetryableError(f"请求失败，状态码: {response.status_code}")
+        return response.json()
 
-        # 发送预约请求
-        response = self.session.post(self.book_url, data=self.encoded_payload, headers=self.headers)
-        # 处理响应
-        if response.status_code == 200:
-            try:
-                result = response.json()
-            except Exception as e:
-                print("fail to convert!")
-                url = 'http://order.njmu.edu.cn:8088/cgyd/product/show.html?id=22'
-                self.session.get(url)
-                print(response.content.decode('utf-8'))
-                cnt += 1
-                self.pre_book()
-                raise e
-            if result['result'] == '1':
-                print("预约成功！")
-                print(result['message'])
-            elif '未到该日期的预订时间' in result['message']:
-                print(f"预约失败：{result['message']}")
-                cnt += 1
-                self.pre_book()
-            elif '每日限预约一场' in result['message']:
-                print(f"预约失败：{result['message']}")
-            else:
-                print(f"其他错误：{result['message']}")
-                cnt += 1
-                self.pre_book()
+    def pre_book(self, policy: RetryPolicy = None):
+        """发送预约请求并按重试策略重试，返回包含每次尝试耗时的结果"""
+        result = RetryEngine(policy or self.retry_policy, context=self.log_context).run(self._send)
+        log_extra = {
+            **self.log_context,
+            "outcome": result["outcome"],
+            "attempts": len(result["attempts"]),
+            "elapsed": result["elapsed"],
+        }
+        if result["success"]:
+            logger.info("预约成功！%s", result["message"], extra=log_extra)
         else:
-            print(f"请求失败，状态码: {response.status_code}")
-            cnt += 1
-            self.pre_book()
-
+            logger.info("预约失败：%s（共尝试 %d 次）", result["message"], len(result["attempts"]), extra=log_extra)
+        return result
 
     @staticmethod
     def book_venue():
-        global cnt
-        if cnt==5:
-            return
-        session = Login.get_session()
-        # 准备预约请求数据 (将其 URL 编码)
-        book_url = f"{Config.BASE_URL}/cgyd/order/tobook.html"
-        payload = {
-            "param": {
-                "stockdetail": {str(Config.BOOKING_DATA['stockid']): str(Config.BOOKING_DATA['stockdetail_id'])},
-                "serviceid": Config.BOOKING_DATA['serviceid'],
-                "stockid": f"{Config.BOOKING_DATA['stockid']},",
-                "remark": "",
-                "users": Config.BOOKING_DATA['users']
-            },
-            "num": 1,
-            "json": True
-        }
-
-        # 将 payload 字典转换为 URL 编码的字符串
-        encoded_payload = urlencode({
-            "param": json.dumps(payload["param"]),
-            "num": payload["num"],
-            "json": payload["json"]
-        })
-
-        headers = {
-            "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
-            "X-Requested-With": "XMLHttpRequest",
-            "Referer": f"{Config.BASE_URL}/cgyd/product/show.html?id={Config.BOOKING_DATA['serviceid']}"
-        }
-
-        # 发送预约请求
-        response = session.post(book_url, data=encoded_payload, headers=headers)
-        # 处理响应
-        if response.status_code == 200:
-            result = response.json()
-            if result['result'] == '1':
-                print("预约成功！")
-                print(result['message'])
-            elif '未到该日期的预订时间' in result['message']:
-                print(f"预约失败：{result['message']}")
-                cnt += 1
-                Booking.book_venue()
-            elif '每日限预约一场' in result['message']:
-                print(f"预约失败：{result['message']}")
-            else:
-                print(f"其他错误：{result['message']}")
-        else:
-            print(f"请求失败，状态码: {response.status_code}")
+        """使用 Config 中的登录信息和预约参数进行预约"""
+        booking = Booking(
+            stockid=Config.BOOKING_DATA['stockid'],
+            serviceid=Config.BOOKING_DATA['serviceid'],
+            id=Config.BOOKING_DATA['stockdetail_id'],
+            users=Config.BOOKING_DATA['users'],
+            username=Config.LOGIN_DATA['dlm'],
+            password=Config.LOGIN_DATA['mm']
+        )
+        return booking.pre_book()
 
 if __name__ == '__main__':
     Booking.book_venue()
@@ -1,8 +1,10 @@
 import json
 import os
 from fetch_data import FetchData
+from json_stream import project_items
 from config import Config
 from book import Booking
+from logging_config import setup_logging
 
 
 def prompt_for_date_and_serviceid():
@@ -38,18 +40,20 @@ def get_user_choice(prompt, total_options):
 def run_cli():
     date, serviceid = prompt_for_date_and_serviceid()
 
-    # 尝试加载本地已有的 JSON 数据
-    data = FetchData.load_data_from_json(date, serviceid)
+    # 尝试加载本地已有的 JSON 数据（流式读取，只保留用到的字段）
+    items = FetchData.load_data_from_json(date, serviceid)
 
     # 如果没有数据，则尝试在线获取
-    if data is None:
+    if items is None:
         print(f"没有找到 {date} 的数据，正在获取...")
-        data = FetchData.fetch_service_data(date, serviceid)
-        if data:
-            FetchData.save_data_to_json(data, date, serviceid)
+        fetched = FetchData.fetch_service_data(date, serviceid)
+        if fetched:
+            FetchData.save_data_to_json(fetched, date, serviceid)
+            items = project_items(fetched)
         else:
             print("无法获取数据，程序终止。")
             return
+    data = list(items)
 
     # 展示获取到的场馆信息并让用户选择
     total_options = display_options(data)
@@ -78,4 +82,5 @@ def run_cli():
 
 
 if __name__ == "__main__":
+    setup_logging()
     run_cli()
@@ -0,0 +1,111 @@
+"""
+服务器时钟校准
+根据 Config.BASE_URL 响应的 Date 头估计服务器时钟与本地时钟的偏差以及单程网络延迟，
+让预约请求按服务器时钟的开放时刻“到达”，而不是按本地时钟发出
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+import requests
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class ServerClock:
+    """服务器时钟估计
+
+    Date 头只精确到秒：响应的 Date 为 D 时，服务器处理请求的时刻落在 [D, D+1) 内，
+    同时又落在本地的发送和接收时刻之间。因此每个样本都给出偏差的一个区间
+    [D - t_recv, D + 1 - t_send]，错开采样相位后取各区间的交集即可把误差缩小到 RTT 量级。
+    """
+
+    def __init__(self):
+        self.offset = 0.0            # 服务器时间 - 本地时间（秒）
+        self.one_way_latency = 0.0   # 估计的单程延迟（秒）
+        self.error = None            # 偏差估计的误差范围（秒）
+        self.rtt = None              # 最小往返时间（秒）
+        self.samples = 0
+        self.updated_at = None
+        self._lock = threading.Lock()
+
+    def _sample(self, session: requests.Session, url: str):
+        """采样一次，返回 (偏差下界, 偏差上界, 往返时间)"""
+        sent = time.time()
+        response = session.get(url, timeout=Config.REQUEST_TIMEOUT)
+        received = time.time()
+        date = response.headers.get("Date")
+        if not date:
+            raise ValueError("响应中没有 Date 头")
+        server_second = parsedate_to_datetime(date).timestamp()
+        return server_second - received, server_second + 1 - sent, received - sent
+
+    def calibrate(self, samples: int = None) -> dict:
+        """采样并更新偏差估计（阻塞，包含多次网络请求）"""
+        samples = samples or Config.CLOCK_SYNC_SAMPLES
+        url = f"{Config.BASE_URL}{Config.CLOCK_SYNC_PATH}"
+        bounds = []
+        with requests.Session() as session:
+            # 第一次请求包含建立连接的耗时，不计入样本
+            session.get(url, timeout=Config.REQUEST_TIMEOUT)
+            for i in range(samples):
+                bounds.append(self._sample(session, url))
+                # 错开采样相位，让样本落在服务器秒边界的不同位置
+                time.sleep(Config.CLOCK_SYNC_SPACING)
+
+        low = max(b[0] for b in bounds)
+        high = min(b[1] for b in bounds)
+        if low > high:
+            # 区间没有交集（服务器 Date 取整方式异常等），退化为各区间中点的中位数
+            midpoints = sorted((b[0] + b[1]) / 2 for b in bounds)
+            offset = midpoints[len(midpoints) // 2]
+            error = max(b[1] - b[0] for b in bounds) / 2
+        else:
+            offset = (low + high) / 2
+            error = (high - low) / 2
+        rtt = min(b[2] for b in bounds)
+
+        with self._lock:
+            self.offset = offset
+            self.error = error
+            self.rtt = rtt
+            self.one_way_latency = rtt / 2
+            self.samples = len(bounds)
+            self.updated_at = datetime.now()
+        logger.info("时钟偏差 %.1fms (±%.1fms), 单程延迟 %.1fms", offset * 1000, error * 1000, rtt * 500,
+                    extra={"offset": offset, "error": error, "rtt": rtt})
+        return self.status()
+
+    def server_now(self) -> datetime:
+        """按估计换算的当前服务器时间"""
+        return datetime.now() + timedelta(seconds=self.offset)
+
+    def to_local(self, server_time: datetime) -> datetime:
+        """换算出请求应在本地何时发出，才能在服务器时间 server_time 到达服务器"""
+        with self._lock:
+            shift = self.offset + self.one_way_latency
+        return server_time - timedelta(seconds=shift)
+
+    def from_local(self, local_time: datetime) -> datetime:
+        """to_local 的逆换算：本地 local_time 发出的请求到达服务器时的服务器时间"""
+        with self._lock:
+            shift = self.offset + self.one_way_latency
+        return local_time + timedelta(seconds=shift)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "offset_ms": round(self.offset * 1000, 3),
+                "error_ms": None if self.error is None else round(self.error * 1000, 3),
+                "rtt_ms": None if self.rtt is None else round(self.rtt * 1000, 3),
+                "one_way_latency_ms": round(self.one_way_latency * 1000, 3),
+                "samples": self.samples,
+                "updated_at": self.updated_at,
+                "server_now": self.server_now(),
+            }
+
+
+# 进程内共享的服务器时钟估计
+server_clock = ServerClock()
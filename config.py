@@ -1,5 +1,6 @@
 # config.py
 import datetime
+import os
 
 
 class Config:
@@ -24,14 +25,99 @@ class Config:
         'stockdetail_id': '' # 用户选择场馆的详细库存ID
     }
 
-    # 基础 URL
-    BASE_URL = 'http://order.njmu.edu.cn:8088'
+    # 基础 URL，可通过环境变量 ORDER_BASE_URL 指向本地模拟服务（benchmarks/upstream_simulator.py）
+    BASE_URL = os.environ.get('ORDER_BASE_URL', 'http://order.njmu.edu.cn:8088').rstrip('/')
+    REQUEST_TIMEOUT = 10  # 访问源系统的单次 HTTP 请求超时（秒），同步 requests 和异步客户端共用
+
+    # 数据库
+    DB_URL = 'sqlite:///./data/reservation.db'
+    DB_POOL_SIZE = 10  # 常驻连接数：API 线程池、执行器和后台轮询共用
+    DB_MAX_OVERFLOW = 20  # 高峰时允许额外打开的连接数
+    DB_POOL_TIMEOUT = 10  # 等待空闲连接的超时（秒）
+    SQLITE_JOURNAL_MODE = 'WAL'  # 写入不阻塞读取
+    SQLITE_SYNCHRONOUS = 'NORMAL'  # WAL 模式下只在检查点时 fsync
+    SQLITE_BUSY_TIMEOUT = 5000  # 等待写锁的时间（毫秒）
+    SQLITE_CACHE_SIZE = -20000  # 页缓存大小，负数表示 KiB（约 20MB）
+    SQLITE_MMAP_SIZE = 256 * 1024 * 1024  # 内存映射读取的最大字节数
 
     # 预约时间规则
     BOOKING_HOURS = (8, 23)  # 允许预约的时间段
 
     # 自动任务定时器
-    SCHEDULE_TIME = "08:00"  # 定时任务执行时间，每天8:00执行
+    SCHEDULE_TIME = "08:00"  # 定时任务执行时间，每天8:00执行（服务器时间）
+    AUTO_BOOKING_TIME = (8, 0, 5)  # 自动预约任务在预约日前一天的执行时间（服务器时间）
+
+    # 登录会话池
+    SESSION_TTL = 20 * 60  # 会话从登录起的最长复用时间（秒）
+    SESSION_MAX_IDLE = 10 * 60  # 会话最长空闲时间（秒），超过后重新登录
+    SESSION_PREWARM_WORKERS = 8  # 预热登录的并发数
+    SESSION_PREWARM_AHEAD = 5 * 60  # 提前多久为即将执行的任务预热登录（秒）
+
+    # 两阶段执行
+    PREPARE_AHEAD = 30  # 准备阶段（登录、构造请求）提前于执行时间的秒数
+    CONNECTION_WARM_AHEAD = 3  # 触发前多少秒再次访问预约页面，保持连接不被服务器关闭
+
+    # 预约重试节奏
+    RETRY_BURST_INTERVAL = 0.05  # 开放时刻附近的密集重试间隔（秒）
+    RETRY_BURST_WINDOW = 2.0  # 密集重试持续时间（秒），之后进入指数退避
+    RETRY_BACKOFF_BASE = 0.2  # 退避初始间隔（秒）
+    RETRY_BACKOFF_MAX = 2.0  # 退避最大间隔（秒）
+    RETRY_DEADLINE = 30  # 单次预约的重试截止时间（秒）
+    RETRY_MAX_ATTEMPTS = 100  # 单次预约的最大尝试次数
+    RETRY_BUSY_MESSAGES = ['系统繁忙']  # 除“未到该日期的预订时间”外，包含这些内容的 message 也会重试，其余 message 均不再重试
+
+    # 异步预约客户端
+    ASYNC_MAX_CONNECTIONS = 100  # 共享客户端的最大连接数
+    ASYNC_MAX_PER_HOST = 20  # 同一主机同时在途的预约请求上限
+    ASYNC_KEEPALIVE_EXPIRY = 60  # 空闲 keep-alive 连接的保留时间（秒）
+
+    # 精确定时器
+    SCHEDULER_SPIN = 0.002  # 到期前最后多少秒改为忙等（秒）
+    SCHEDULER_RESYNC_INTERVAL = 10 * 60  # 从数据库兜底同步任务计划的间隔（秒）
+    RESULT_SAVE_RETRY_INTERVAL = 5  # 执行结果写回数据库失败后的重试间隔（秒），结果在写回成功前保留在内存中
+
+    # 多场馆并发预约
+    FANOUT_WIDTH = 3  # 每个任务同时预约的场馆数（主场馆加按优先级排序的备选场馆）
+
+    # 服务器时钟校准
+    CLOCK_SYNC_PATH = "/cgyd/login.html"  # 用于读取 Date 头的地址
+    CLOCK_SYNC_SAMPLES = 8  # 每次校准的采样次数
+    CLOCK_SYNC_SPACING = 0.13  # 采样间隔（秒），取非整数以错开服务器秒边界
+    CLOCK_SYNC_INTERVAL = 5 * 60  # 重新校准的间隔（秒）
+
+    # 场馆数据导入
+    IMPORT_CHUNK_SIZE = 500  # 批量写入时每次 executemany 的行数
+    IMPORT_READ_CHUNK_SIZE = 64 * 1024  # 流式读取数据文件时每次读取的字符数
+    SNAPSHOT_FORMAT = "jsonl.gz"  # 新保存的数据文件格式: json（完整原始数据）、jsonl、jsonl.gz（只保存用到的字段）
+
+    # 场馆余量缓存
+    AVAILABILITY_TTL = 60  # 缓存的可用场馆在多少秒内直接返回
+    AVAILABILITY_STALE_TTL = 10 * 60  # 过期后多少秒内仍先返回旧结果并在后台刷新
+    AVAILABILITY_STALE_WHILE_REVALIDATE = True  # 关闭后过期即同步刷新
+    AVAILABILITY_CACHE_SIZE = 256  # 最多缓存的 (serviceid, date) 数
+
+    # 场馆余量后台轮询
+    POLL_SERVICE_IDS = [22, 42]  # 轮询的场馆类型
+    POLL_DAYS_AHEAD = 3  # 轮询今天起的多少天
+    POLL_INTERVAL_FAST = 5  # 开放预约前后的轮询间隔（秒）
+    POLL_INTERVAL_SLOW = 5 * 60  # 其余时间的轮询间隔（秒）
+    POLL_FAST_BEFORE = 2 * 60  # 开放预约（Config.AUTO_BOOKING_TIME，服务器时间）前多少秒开始快速轮询
+    POLL_FAST_AFTER = 15 * 60  # 开放预约后多少秒内保持快速轮询
+
+    # 日志
+    LOG_FILE = 'logs/app.log'  # JSON 行格式的日志文件，为空时不写文件
+    LOG_LEVEL = 'INFO'  # 全局日志级别
+    LOG_LEVELS = {  # 按模块覆盖日志级别，如 {'repositories': 'DEBUG'} 输出查询 SQL
+        'sqlalchemy.engine': 'WARNING',
+        'httpx': 'WARNING',
+    }
+    LOG_MAX_BYTES = 10 * 1024 * 1024  # 单个日志文件的大小上限，超过后轮转
+    LOG_BACKUP_COUNT = 5  # 保留的轮转文件数
+    LOG_CONSOLE = True  # 是否同时输出到控制台
+
+    # 列表分页
+    PAGE_SIZE = 50  # 列表接口默认每页条数
+    PAGE_SIZE_MAX = 500  # 列表接口每页条数上限
 
     @staticmethod
     def is_booking_time():
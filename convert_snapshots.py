@@ -0,0 +1,51 @@
+"""
+把 data 目录下旧的 service_data_*.json 转换为紧凑快照格式
+只保留导入和命令行用到的字段，转换后逐条核对内容一致再删除原文件（--keep 保留原文件）
+
+用法: python convert_snapshots.py [--format jsonl.gz|jsonl] [--data-dir data] [--keep]
+"""
+import argparse
+import os
+from pathlib import Path
+from config import Config
+from json_stream import iter_venue_items, write_venue_items, SNAPSHOT_SUFFIXES
+
+
+def convert_file(path: Path, snapshot_format: str, keep: bool = False):
+    """转换单个文件，返回 (新文件路径, 条数, 原大小, 新大小)"""
+    target = path.with_name(path.name[:-len(".json")] + SNAPSHOT_SUFFIXES[snapshot_format])
+    count = write_venue_items(target, iter_venue_items(path))
+
+    # 核对转换结果，不一致时删除新文件并保留原文件
+    if list(iter_venue_items(target)) != list(iter_venue_items(path)):
+        os.remove(target)
+        raise ValueError(f"转换结果与原文件不一致: {path}")
+
+    original_size = path.stat().st_size
+    if not keep:
+        os.remove(path)
+    return target, count, original_size, target.stat().st_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="转换数据文件为紧凑快照格式")
+    parser.add_argument("--format", default=Config.SNAPSHOT_FORMAT, choices=["jsonl", "jsonl.gz"])
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--keep", action="store_true", help="保留原 .json 文件")
+    args = parser.parse_args()
+
+    total_before = total_after = 0
+    for path in sorted(Path(args.data_dir).glob("service_data_*.json")):
+        try:
+            target, count, before, after = convert_file(path, args.format, args.keep)
+        except Exception as e:
+            print(f"转换失败: {path.name}, 错误: {str(e)}")
+            continue
+        total_before += before
+        total_after += after
+        print(f"{path.name} -> {target.name}: {count} 条, {before} -> {after} 字节")
+    print(f"合计: {total_before} -> {total_after} 字节")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1 @@
-python -m alembic revision --autogenerate -m "init"
-python -m alembic upgrade head
\ No newline at end of file
+python -m migrations
\ No newline at end of file
@@ -0,0 +1,49 @@
+"""
+数据库引擎
+SQLite 连接在建立时设置 PRAGMA：
+- WAL 日志模式：写入不阻塞读取，08:00 集中写回任务状态时查询接口仍可读
+- synchronous=NORMAL：WAL 模式下只在检查点时 fsync，断电最多丢失最近的事务，不会损坏数据库
+- busy_timeout：写锁被占用时等待而不是立即报 database is locked
+- cache_size / mmap_size：加大页缓存并用内存映射读取
+各项取值见 Config 的 SQLITE_* 和 DB_* 配置
+"""
+from sqlalchemy import create_engine, event
+from config import Config
+
+
+def sqlite_pragmas(journal_mode: str = None) -> dict:
+    """连接建立时执行的 PRAGMA"""
+    return {
+        "journal_mode": journal_mode or Config.SQLITE_JOURNAL_MODE,
+        "synchronous": Config.SQLITE_SYNCHRONOUS,
+        "busy_timeout": Config.SQLITE_BUSY_TIMEOUT,
+        "cache_size": Config.SQLITE_CACHE_SIZE,
+        "mmap_size": Config.SQLITE_MMAP_SIZE,
+        "temp_store": "MEMORY",
+    }
+
+
+def create_db_engine(url: str = None, journal_mode: str = None):
+    """创建数据库引擎，url 默认为 Config.DB_URL，journal_mode 默认为 Config.SQLITE_JOURNAL_MODE"""
+    url = url or Config.DB_URL
+    if not url.startswith("sqlite"):
+        return create_engine(url, pool_size=Config.DB_POOL_SIZE, max_overflow=Config.DB_MAX_OVERFLOW,
+                             pool_timeout=Config.DB_POOL_TIMEOUT)
+
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        pool_size=Config.DB_POOL_SIZE,
+        max_overflow=Config.DB_MAX_OVERFLOW,
+        pool_timeout=Config.DB_POOL_TIMEOUT,
+    )
+    pragmas = sqlite_pragmas(journal_mode)
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return engine
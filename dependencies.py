@@ -1,5 +1,9 @@
+from fastapi import Depends
 from sqlalchemy.orm import Session
 from sqlalchemy.orm import sessionmaker
+from repositories import (
+    VenueRepository, BookingRepository, AccountRepository, AutoBookingRepository, VenueStatusChangeRepository
+)
 
 def get_db():
     from main import SessionLocal  # 延迟导入
@@ -7,4 +11,32 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# 仓库依赖：FastAPI 在同一请求内缓存 get_db 的结果，一个请求的所有仓库共用同一个会话，
+# 响应结束后由 get_db 关闭会话并把连接归还连接池
+def get_venue_repo(db: Session = Depends(get_db)) -> VenueRepository:
+    return VenueRepository(db)
+
+def get_booking_repo(db: Session = Depends(get_db)) -> BookingRepository:
+    return BookingRepository(db)
+
+def get_account_repo(db: Session = Depends(get_db)) -> AccountRepository:
+    return AccountRepository(db)
+
+def get_auto_booking_repo(db: Session = Depends(get_db)) -> AutoBookingRepository:
+    return AutoBookingRepository(db)
+
+def get_venue_status_change_repo(db: Session = Depends(get_db)) -> VenueStatusChangeRepository:
+    return VenueStatusChangeRepository(db)
+
+def pool_status() -> dict:
+    """数据库连接池的当前状态"""
+    from main import engine  # 延迟导入
+    pool = engine.pool
+    status = {"pool": type(pool).__name__, "status": pool.status()}
+    # QueuePool 提供以下计数，其他连接池类型只返回描述
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            status[name] = getattr(pool, name)()
+    return status
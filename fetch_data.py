@@ -1,97 +1,251 @@
 import requests
-import json
+import logging
 import os
-from models import Venue
+import time
+import hashlib
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Venue, ImportManifest, VenueStatusChange
+from config import Config
+from json_stream import iter_venue_items, write_venue_items, SNAPSHOT_SUFFIXES
+
+logger = logging.getLogger(__name__)
 
 class FetchData:
     @staticmethod
     def fetch_service_data(date, serviceid):
         """获取指定日期和 serviceid 的场地信息"""
-        url = f"http://order.njmu.edu.cn:8088/cgyd/product/findOkArea.html"
+        url = f"{Config.BASE_URL}/cgyd/product/findOkArea.html"
         params = {
             "s_date": date,
             "serviceid": serviceid
         }
 
-        response = requests.get(url, params=params)
+        response = requests.get(url, params=params, timeout=Config.REQUEST_TIMEOUT)
         if response.status_code == 200:
             data = response.json().get('object')
             if data:
                 return data
             else:
-                print("没有获取到数据")
+                logger.warning("没有获取到数据: serviceid=%s date=%s", serviceid, date)
         else:
-            print(f"请求失败，状态码: {response.status_code}")
+            logger.warning("请求失败，状态码: %s", response.status_code)
         return None
 
+    @staticmethod
+    def snapshot_path(date, serviceid, snapshot_format=None):
+        """数据文件路径，格式默认为 Config.SNAPSHOT_FORMAT"""
+        suffix = SNAPSHOT_SUFFIXES[snapshot_format or Config.SNAPSHOT_FORMAT]
+        return os.path.join('data', f"service_data_{serviceid}_{date}{suffix}")
+
     @staticmethod
     def save_data_to_json(data, date, serviceid):
-        """保存获取到的数据为 JSON 文件"""
+        """保存获取到的数据为 Config.SNAPSHOT_FORMAT 格式的数据文件，返回文件路径"""
         folder = 'data'
         if not os.path.exists(folder):
             os.makedirs(folder)
 
-        filename = os.path.join(folder, f"service_data_{serviceid}_{date}.json")
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-        print(f"数据保存为 {filename}")
+        filename = FetchData.snapshot_path(date, serviceid)
+        write_venue_items(filename, data)
+        logger.info("数据保存为 %s", filename)
+        return filename
 
     @staticmethod
     def load_data_from_json(date, serviceid):
-        """从指定日期的 JSON 文件加载数据"""
-        folder = 'data'
-        filename = os.path.join(folder, f"service_data_{serviceid}_{date}.json")
-        if os.path.exists(filename):
-            with open(filename, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        else:
-            return None
+        """从指定日期的数据文件流式加载数据，只保留用到的字段
+
+        依次查找 jsonl.gz、jsonl 和旧的 json 格式，都不存在时返回 None
+        """
+        for snapshot_format in ("jsonl.gz", "jsonl", "json"):
+            filename = FetchData.snapshot_path(date, serviceid, snapshot_format)
+            if os.path.exists(filename):
+                return iter_venue_items(filename)
+        return None
 
 
 class DataImporter:
-    """New class for handling JSON to database imports"""
+    """New class for handling JSON to database imports
+
+    同一文件的场馆按 (serviceid, date) 一次查出已有记录，只写入新增或有变化的行；
+    写入使用 SQLite 的 INSERT ... ON CONFLICT(original_id) DO UPDATE，按 Config.IMPORT_CHUNK_SIZE 分批 executemany
+    """
+    # 写入和比较的字段，original_id 为冲突键
+    FIELDS = ("original_id", "serviceid", "stockid", "date", "time_no", "sname", "status")
+
     def __init__(self, db_session):
         self.db = db_session
-        
-    def import_from_json(self, json_path):
-        """Import venue data from JSON file to database"""
-        with open(json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            
-        for item in data:
-            # 添加原始ID校验
-            if not item.get('id') or not item.get('stock'):
-                print(f"跳过无效条目: {item.get('id')}")
+
+    @staticmethod
+    def to_row(item, serviceid: int = 22, date: str = ''):
+        """把接口返回的一条场馆数据转换为 venues 表的一行，无效条目返回 None
+
+        serviceid 和 date 为条目中缺少对应字段时的默认值
+        """
+        # 添加原始ID校验
+        if not item.get('id') or not item.get('stock'):
+            logger.debug("跳过无效条目: %s", item.get('id'))
+            return None
+
+        try:
+            row = {
+                "original_id": int(item['id']),
+                "serviceid": int(item['stock'].get('serviceid') or serviceid),
+                "stockid": int(str(item['stockid']).strip()),
+                "date": (item['stock'].get('s_date') or date).strip(),
+                "time_no": (item['stock'].get('time_no') or '').replace(" ", ""),
+                "sname": item['sname'].strip(),
+                "status": 1 if item.get('status') == 1 else 0
+            }
+        except (KeyError, ValueError, TypeError, AttributeError) as e:
+            logger.debug("数据转换错误: %s", e)
+            return None
+
+        # 添加字段完整性检查
+        if not all([row["original_id"], row["serviceid"], row["stockid"]]):
+            logger.debug("缺失关键字段: ID=%s", item['id'])
+            return None
+        return row
+
+    def _existing_rows(self, rows):
+        """按 (serviceid, date) 一次查出已有记录: original_id -> 字段元组"""
+        existing = {}
+        columns = [getattr(Venue, field) for field in self.FIELDS]
+        for serviceid, date in {(row["serviceid"], row["date"]) for row in rows}:
+            for record in self.db.query(*columns).filter(Venue.serviceid == serviceid, Venue.date == date):
+                existing[record[0]] = tuple(record)
+        return existing
+
+    def upsert_rows(self, rows, skipped: int = 0) -> dict:
+        """写入新增行、更新有变化的行，返回各类行数和耗时（秒）
+
+        新增场馆和状态变化在同一事务中追加到 venue_status_changes，所有导入途径都经过这里，变化不会漏记
+        """
+        started = time.perf_counter()
+        existing = self._existing_rows(rows)
+        queried = time.perf_counter()
+
+        inserts, updates = [], []
+        seen = set()
+        for row in rows:
+            if row["original_id"] in seen:
+                skipped += 1
                 continue
-                
-            try:
-                venue = Venue(
-                    original_id=int(item['id']),  # 新增字段
-                    serviceid=int(item['stock'].get('serviceid', 22)),
-                    stockid=int(item['stockid']),
-                    date=item['stock'].get('s_date', '').strip(),
-                    time_no=item['stock'].get('time_no', '').replace(" ", ""),
-                    sname=item['sname'].strip(),
-                    status=1 if item.get('status') == 1 else 0
-                )
-                
-                # 添加字段完整性检查
-                if not all([venue.original_id, venue.serviceid, venue.stockid]):
-                    print(f"缺失关键字段: ID={item['id']}")
-                    continue
-                    
-                # 修改查询条件包含original_id
-                exists = self.db.query(Venue).filter(
-                    Venue.original_id == venue.original_id,
-                    Venue.date == venue.date
-                ).first()
-                
-                if not exists:
-                    self.db.add(venue)
-                    
-            except (KeyError, ValueError, TypeError) as e:
-                print(f"数据转换错误: {str(e)}")
+            seen.add(row["original_id"])
+            old = existing.get(row["original_id"])
+            if old is None:
+                inserts.append(row)
+            elif old != tuple(row[field] for field in self.FIELDS):
+                updates.append(row)
+            else:
+                skipped += 1
+
+        changed = inserts + updates
+        if changed:
+            statement = sqlite_insert(Venue)
+            statement = statement.on_conflict_do_update(
+                index_elements=[Venue.original_id],
+                set_={field: statement.excluded[field] for field in self.FIELDS if field != "original_id"}
+            )
+            chunk_size = Config.IMPORT_CHUNK_SIZE
+            for i in range(0, len(changed), chunk_size):
+                self.db.execute(statement, changed[i:i + chunk_size])
+
+        status_changes = []
+        now = datetime.now()
+        status_index = self.FIELDS.index("status")
+        for row in changed:
+            old = existing.get(row["original_id"])
+            old_status = None if old is None else old[status_index]
+            if old is not None and old_status == row["status"]:
                 continue
-                
+            status_changes.append({
+                "original_id": row["original_id"],
+                "serviceid": row["serviceid"],
+                "date": row["date"],
+                "time_no": row["time_no"],
+                "sname": row["sname"],
+                "old_status": old_status,
+                "new_status": row["status"],
+                "changed_at": now,
+            })
+        if status_changes:
+            self.db.execute(insert(VenueStatusChange), status_changes)
+        self.db.commit()
+        written = time.perf_counter()
+
+        return {
+            "inserted": len(inserts),
+            "updated": len(updates),
+            "skipped": skipped,
+            "status_changes": len(status_changes),
+            "query_seconds": round(queried - started, 4),
+            "write_seconds": round(written - queried, 4),
+        }
+
+    def import_items(self, items, serviceid: int = 22, date: str = '') -> dict:
+        """导入场馆条目，items 可以是生成器，逐条转换后不再保留原始条目"""
+        started = time.perf_counter()
+        rows, skipped = [], 0
+        for item in items:
+            row = self.to_row(item, serviceid, date)
+            if row is None:
+                skipped += 1
+            else:
+                rows.append(row)
+        parsed = time.perf_counter()
+
+        stats = self.upsert_rows(rows, skipped)
+        stats["valid"] = len(rows)
+        stats["parse_seconds"] = round(parsed - started, 4)
+        stats["total_seconds"] = round(time.perf_counter() - started, 4)
+        return stats
+
+    def import_from_json(self, json_path) -> dict:
+        """Import venue data from JSON file to database"""
+        # 边读边转换，不把整个文件载入内存
+        stats = self.import_items(iter_venue_items(json_path))
+        logger.info(
+            "Imported data from %s: 新增 %d, 更新 %d, 跳过 %d, 耗时 %ss",
+            json_path, stats["inserted"], stats["updated"], stats["skipped"], stats["total_seconds"],
+            extra={"path": str(json_path), **stats}
+        )
+        return stats
+
+    @staticmethod
+    def file_hash(path) -> str:
+        """文件内容的 SHA-256"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def import_if_changed(self, json_path):
+        """只导入新增或内容有变化的文件，返回导入结果；文件未变化时返回 None
+
+        大小和修改时间与清单一致时直接跳过；不一致时再比较内容哈希，内容未变只更新清单
+        """
+        path = str(json_path)
+        stat = os.stat(path)
+        manifest = self.db.query(ImportManifest).filter(ImportManifest.path == path).first()
+        if manifest and manifest.size == stat.st_size and manifest.mtime == stat.st_mtime:
+            return None
+
+        sha256 = self.file_hash(path)
+        if manifest and manifest.sha256 == sha256:
+            manifest.size = stat.st_size
+            manifest.mtime = stat.st_mtime
+            self.db.commit()
+            return None
+
+        stats = self.import_from_json(path)
+        if manifest is None:
+            manifest = ImportManifest(path=path)
+            self.db.add(manifest)
+        manifest.size = stat.st_size
+        manifest.mtime = stat.st_mtime
+        manifest.sha256 = sha256
+        manifest.result = stats
         self.db.commit()
-        print(f"Imported data from {json_path}")
+        return stats
@@ -1,8 +1,9 @@
 import requests
 import json
+from config import Config
 
 # 定义要请求的 URL
-url = "http://order.njmu.edu.cn:8088/cgyd/product/findOkArea.html"
+url = f"{Config.BASE_URL}/cgyd/product/findOkArea.html"
 
 # 定义请求参数，指定日期和场馆类型（serviceid: 42，表示特定的场馆）
 params = {
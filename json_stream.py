@@ -0,0 +1,167 @@
+"""
+场馆数据文件的流式读写
+旧的数据文件是 indent=4 写出的 JSON 数组，每个条目带一个字段很多的 stock 对象，而导入和命令行只用到其中几个字段。
+逐块读取文件、每次只解码一个条目并立即裁剪字段，内存占用与单个条目相当，而不是整个文件的数倍。
+
+新的快照格式只保存裁剪后的字段，每行一个紧凑的 JSON 条目（.jsonl），可选 gzip 压缩（.jsonl.gz）；
+iter_venue_items 按扩展名识别格式，旧的 .json 文件仍可直接读取
+"""
+import gzip
+import io
+import json
+import re
+from contextlib import contextmanager
+from config import Config
+
+# 保留的字段，stock 中的字段仍放在 stock 下，与原始数据结构一致
+ITEM_FIELDS = ("id", "stockid", "sname", "status")
+STOCK_FIELDS = ("s_date", "time_no", "serviceid", "price")
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+# 数字、true/false/null 之后必须出现的分隔符，出现之前不能确定标量已读完整
+_SCALAR_END = re.compile(r"[,\] \t\n\r]")
+
+
+def project_item(item: dict) -> dict:
+    """只保留用到的字段"""
+    projected = {field: item.get(field) for field in ITEM_FIELDS}
+    stock = item.get("stock")
+    projected["stock"] = {field: stock.get(field) for field in STOCK_FIELDS} if isinstance(stock, dict) else None
+    return projected
+
+
+def project_items(items):
+    """逐条裁剪已在内存中的条目（如接口返回的数据）"""
+    for item in items:
+        yield project_item(item)
+
+
+def iter_json_array(fp, chunk_size: int = None):
+    """逐个解码文件对象 fp 中顶层 JSON 数组的元素"""
+    chunk_size = chunk_size or Config.IMPORT_READ_CHUNK_SIZE
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            eof = True
+            return
+        # 丢弃已解析的部分，避免缓冲区随文件增长
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    def skip(chars):
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in chars:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    def next_char() -> str:
+        skip(_WHITESPACE)
+        if pos >= len(buffer):
+            raise ValueError("JSON 数组不完整")
+        return buffer[pos]
+
+    skip(_WHITESPACE)
+    if pos >= len(buffer) or buffer[pos] != "[":
+        raise ValueError("数据文件不是 JSON 数组")
+    pos += 1
+    if next_char() == "]":
+        return
+
+    while True:
+        # 标量没有结束符，缓冲区中出现分隔符后再解码，避免 1.5e3 这样的数字在 . 或 e 处被截断
+        if buffer[pos] not in '{["':
+            while not eof and not _SCALAR_END.search(buffer, pos):
+                fill()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(buffer, pos)
+                break
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+        pos = end
+        yield value
+
+        # 元素之间必须恰好有一个逗号
+        delimiter = next_char()
+        if delimiter == "]":
+            return
+        if delimiter != ",":
+            raise ValueError(f"JSON 数组元素之间缺少逗号: {delimiter!r}")
+        pos += 1
+        if next_char() in ",]":
+            raise ValueError("JSON 数组中有多余的逗号")
+
+
+# 快照格式 -> 扩展名
+SNAPSHOT_SUFFIXES = {"json": ".json", "jsonl": ".jsonl", "jsonl.gz": ".jsonl.gz"}
+
+
+def snapshot_format(path) -> str:
+    """按扩展名识别快照格式"""
+    name = str(path)
+    if name.endswith(".jsonl.gz"):
+        return "jsonl.gz"
+    if name.endswith(".jsonl"):
+        return "jsonl"
+    if name.endswith(".json"):
+        return "json"
+    raise ValueError(f"无法识别的数据文件格式: {name}")
+
+
+@contextmanager
+def _open_text(path, mode: str):
+    if snapshot_format(path) != "jsonl.gz":
+        with open(path, mode, encoding="utf-8") as f:
+            yield f
+    elif mode == "r":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            yield f
+    else:
+        # gzip 头默认写入当前时间和文件名，固定为空使相同内容写出相同的字节，import_if_changed 的内容哈希才有意义
+        with open(path, "wb") as raw, \
+                gzip.GzipFile(filename="", fileobj=raw, mode="wb", mtime=0) as compressed, \
+                io.TextIOWrapper(compressed, encoding="utf-8") as f:
+            yield f
+
+
+def iter_venue_items(path, chunk_size: int = None):
+    """流式读取场馆数据文件（任一快照格式），逐条返回裁剪后的条目"""
+    with _open_text(path, "r") as f:
+        if snapshot_format(path) == "json":
+            for item in iter_json_array(f, chunk_size):
+                yield project_item(item)
+        else:
+            for line in f:
+                if line.strip():
+                    yield project_item(json.loads(line))
+
+
+def write_venue_items(path, items) -> int:
+    """以 path 扩展名对应的格式写入条目，返回写入条数
+
+    .json 保持原来的完整格式；.jsonl / .jsonl.gz 只写入裁剪后的字段
+    """
+    if snapshot_format(path) == "json":
+        items = list(items)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(items, f, ensure_ascii=False, indent=4)
+        return len(items)
+
+    count = 0
+    with _open_text(path, "w") as f:
+        for item in items:
+            f.write(json.dumps(project_item(item), ensure_ascii=False, separators=(",", ":")))
+            f.write("\n")
+            count += 1
+    return count
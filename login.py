@@ -1,9 +1,13 @@
 # login.py
+import logging
 import requests
 from config import Config
+from metrics import LOGIN_SECONDS
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
 
+logger = logging.getLogger(__name__)
+
 
 class Login:
 
@@ -26,14 +30,22 @@ class Login:
         }
         # 发送登录请求
         session = requests.Session()
-        response = session.post(login_url, data=self.login_data, headers=headers)
-        if response.status_code == 200:
-            print("登录成功，获取 session")
-            url = 'http://order.njmu.edu.cn:8088/cgyd/product/show.html?id=22'
-            session.get(url)
-            return session
-        else:
-            raise Exception("登录失败")
+        try:
+            with LOGIN_SECONDS.time():
+                response = session.post(login_url, data=self.login_data, headers=headers,
+                                        timeout=Config.REQUEST_TIMEOUT)
+            if response.status_code != 200:
+                raise Exception("登录失败")
+            # 密码错误时登录接口同样返回 200，以预约页面是否跳回登录页确认会话有效
+            url = f"{Config.BASE_URL}/cgyd/product/show.html?id=22"
+            response = session.get(url, timeout=Config.REQUEST_TIMEOUT)
+            if response.status_code != 200 or "login.html" in response.url:
+                raise Exception("登录失败")
+        except Exception:
+            session.close()
+            raise
+        logger.info("登录成功，获取 session", extra={"account": self.username})
+        return session
 
     class LoginService:
         def __init__(self, db: Session):
@@ -45,7 +57,7 @@ class Login:
             response = session.post(login_url, data=Config.LOGIN_DATA, headers=headers)
             if response.status_code == 200:
                 print("登录成功，获取 session")
-                url = 'http://order.njmu.edu.cn:8088/cgyd/product/show.html?id=22'
+                url = f"{Config.BASE_URL}/cgyd/product/show.html?id=22"
                 session.get(url)
                 
                 # 记录登录日志
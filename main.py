@@ -1,55 +1,98 @@
+import logging
+from logging_config import setup_logging
+# 在其他模块创建 logger 之前配置好日志
+setup_logging()
+logger = logging.getLogger(__name__)
+
 from fastapi import FastAPI, Depends
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Index  # 添加 Index
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import Column, Integer, String, DateTime, Index  # 添加 Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 import os
-import threading
+import asyncio
 from contextlib import asynccontextmanager
 from routers import router as api_router
-from models import Base, Venue, BookingRecord, Account, AutoBooking  # 修改导入来源
+from models import Venue, BookingRecord, Account, AutoBooking  # 修改导入来源
 from dependencies import get_db  # 新增导入
+from metrics import render as render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
 
-# 数据库初始化
-engine = create_engine('sqlite:///./data/reservation.db', connect_args={"check_same_thread": False})
+# 数据库初始化（WAL 模式和连接池配置见 database.py）
+from database import create_db_engine
+engine = create_db_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# 数据模型
-# 数据库初始化
-# Remove the duplicate Base declaration and keep this line:
-from models import Base, Venue, BookingRecord, Account, AutoBooking
+# 创建数据库表，并为已有的数据库补建新增的索引
+from migrations import upgrade
+upgrade(engine)
 
-# 创建数据库表
-Base.metadata.create_all(bind=engine)
+# 后台导入数据文件的进度，/health 据此报告是否就绪
+import_status = {"ready": False, "files": 0, "imported": 0, "unchanged": 0, "failed": 0, "error": None}
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # 启动时执行的代码
+def import_data_files():
+    """导入 data 目录下新增或有变化的数据文件（同步，在线程中运行）"""
     from pathlib import Path
     from fetch_data import DataImporter
     
-    print("正在扫描数据文件...")  # 添加初始化日志
-    json_files = list(Path("data").glob("service_data_*.json"))
-    print(f"找到 {len(json_files)} 个数据文件")
+    logger.info("正在扫描数据文件...")
+    # 包括旧的 .json 和新的 .jsonl / .jsonl.gz 快照
+    json_files = sorted(Path("data").glob("service_data_*.json*"))
+    import_status.update(files=len(json_files), imported=0, unchanged=0, failed=0, error=None)
+    logger.info("找到 %d 个数据文件", len(json_files))
     
-    importer = DataImporter(SessionLocal())
-    for file in json_files:
-        print(f"正在导入文件: {file.name}")
-        importer.import_from_json(file)
+    db = SessionLocal()
+    try:
+        importer = DataImporter(db)
+        for file in json_files:
+            try:
+                if importer.import_if_changed(file) is None:
+                    import_status["unchanged"] += 1
+                else:
+                    import_status["imported"] += 1
+            except Exception as e:
+                db.rollback()
+                import_status["failed"] += 1
+                logger.exception("导入文件失败: %s, 错误: %s", file.name, e)
+    finally:
+        db.close()
+    logger.info("数据文件导入完成: 导入 %d 个, 未变化 %d 个", import_status["imported"], import_status["unchanged"])
+
+async def run_startup_import():
+    try:
+        await asyncio.to_thread(import_data_files)
+    except Exception as e:
+        import_status["error"] = str(e)
+        logger.exception("数据文件导入失败: %s", e)
+    finally:
+        import_status["ready"] = True
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时执行的代码
+    # 数据文件在后台导入，不阻塞服务启动，进度见 /health
+    import_task = asyncio.create_task(run_startup_import())
     
-    # 启动自动预约执行器（异步启动，不阻塞主程序）
-    def start_auto_booker():
-        from auto_booker import AutoBooker
-        AutoBooker.start_scheduler()
+    # 启动自动预约执行器（运行在应用的事件循环上，不阻塞主程序）
+    from auto_booker import AutoBooker
+    auto_booker_task = asyncio.create_task(AutoBooker.run())
+    logger.info("自动预约执行器已启动")
     
-    # 创建并启动线程
-    auto_booker_thread = threading.Thread(target=start_auto_booker, daemon=True)
-    auto_booker_thread.start()
-    print("自动预约执行器已启动")
+    # 后台轮询即将到来日期的场馆余量
+    from availability_poller import availability_poller
+    poller_task = asyncio.create_task(availability_poller.run())
     
     yield  # 应用运行
     # 关闭时执行的代码
-    print("应用正在关闭...")
+    logger.info("应用正在关闭...")
+    for task in (poller_task, auto_booker_task):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    # 导入在线程中运行，无法中途取消，等待当前文件完成
+    await import_task
 
 app = FastAPI(
     title="场馆预约系统",
@@ -61,6 +104,17 @@ app = FastAPI(
 )
 app.include_router(api_router, prefix="/api/v1")  # 添加路由挂载
 
+@app.get("/health")
+async def health():
+    """健康检查：启动导入完成前返回 503"""
+    body = {"status": "ok" if import_status["ready"] else "starting", "import": import_status}
+    return JSONResponse(body, status_code=200 if import_status["ready"] else 503)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 文本格式的运行指标"""
+    return Response(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
 # Create static directory if not exists
 static_dir = "static"
 if not os.path.exists(static_dir):
@@ -0,0 +1,221 @@
+"""
+运行指标
+进程内的计数器、仪表和直方图，由 /metrics 按 Prometheus 文本格式输出：
+- 直方图：登录耗时、预约请求耗时、定时器触发延迟、各仓储方法的数据库耗时
+- 计数器：每次预约尝试按结果分类计数，任务按最终结果计数
+- 仪表：待触发任务数、会话池中的会话数、在途预约请求数
+所有操作只在内存中累加，可以从任意线程调用
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# 默认直方图分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# 定时器触发延迟的分桶（秒），关注亚毫秒到几十毫秒
+LATENESS_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+# 数据库耗时的分桶（秒）
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """指标基类，按标签值分别保存数据"""
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}，收到 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        """返回 (名称后缀, 标签值, 额外标签, 值) 列表"""
+        with self._lock:
+            return [("", key, None, value) for key, value in sorted(self._values.items())]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, key, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """可增可减的当前值，也可以在输出时通过回调读取"""
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """输出时调用 function() 取值（仅用于无标签的仪表）"""
+        self._function = function
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        """在代码块执行期间加一"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _samples(self):
+        if self._function is not None:
+            return [("", (), None, self._function())]
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    """按分桶累计观测值的分布"""
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [各分桶计数..., 总和, 次数]，分桶计数不累计，输出时再累加
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """记录代码块的执行耗时"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            items = sorted((key, list(entry)) for key, entry in self._values.items())
+        for key, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                samples.append(("_bucket", key, f'le="{_format_value(float(bound))}"', cumulative))
+            samples.append(("_sum", key, None, entry[-2]))
+            samples.append(("_count", key, None, entry[-1]))
+        return samples
+
+
+def render() -> str:
+    """按 Prometheus 文本格式输出所有指标"""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+def instrument_repository(cls):
+    """类装饰器：记录仓储类每个公开方法的耗时"""
+    for name, attr in list(vars(cls).items()):
+        if name.startswith("_") or not callable(attr):
+            continue
+
+        def wrap(method, method_name=name):
+            @functools.wraps(method)
+            def wrapper(*args, **kwargs):
+                with DB_QUERY_SECONDS.time(repository=cls.__name__, method=method_name):
+                    return method(*args, **kwargs)
+            return wrapper
+
+        setattr(cls, name, wrap(attr))
+    return cls
+
+
+LOGIN_SECONDS = Histogram(
+    "order_login_seconds", "登录（Login.pre_login）耗时"
+)
+BOOKING_REQUEST_SECONDS = Histogram(
+    "order_booking_request_seconds", "单次预约 POST 请求耗时", ["client"]
+)
+SCHEDULER_LATENESS_SECONDS = Histogram(
+    "order_scheduler_lateness_seconds", "定时器实际触发时刻减计划时刻", ["phase"], buckets=LATENESS_BUCKETS
+)
+DB_QUERY_SECONDS = Histogram(
+    "order_db_query_seconds", "仓储方法的数据库耗时", ["repository", "method"], buckets=DB_BUCKETS
+)
+BOOKING_ATTEMPTS = Counter(
+    "order_booking_attempts_total",
+    "预约尝试次数，按结果分类: success、not_open、daily_limit、other_error、http_error",
+    ["outcome"]
+)
+BOOKING_TASKS = Counter(
+    "order_booking_tasks_total", "自动预约任务按最终结果计数", ["outcome"]
+)
+SCHEDULED_TASKS = Gauge(
+    "order_scheduled_tasks", "等待触发的自动预约任务数"
+)
+OPEN_SESSIONS = Gauge(
+    "order_open_sessions", "会话池中已登录的会话数"
+)
+BOOKING_REQUESTS_IN_FLIGHT = Gauge(
+    "order_booking_requests_in_flight", "正在进行中的预约 POST 请求数"
+)
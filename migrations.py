@@ -0,0 +1,39 @@
+"""
+数据库结构迁移
+create_all 只会创建缺失的表，不会给已有的表补建索引；
+upgrade 在启动时对比 models 中声明的索引和数据库中已有的索引，补建缺失的索引
+"""
+import logging
+from sqlalchemy import inspect
+from models import Base
+
+logger = logging.getLogger(__name__)
+
+
+def missing_indexes(engine):
+    """返回 models 中已声明、但数据库中还不存在的索引"""
+    inspector = inspect(engine)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing.extend(index for index in table.indexes if index.name not in existing)
+    return missing
+
+
+def upgrade(engine):
+    """创建缺失的表和索引，可重复执行"""
+    Base.metadata.create_all(bind=engine)
+    created = []
+    for index in missing_indexes(engine):
+        index.create(bind=engine, checkfirst=True)
+        created.append(index.name)
+    if created:
+        logger.info("已补建索引: %s", ", ".join(created))
+    return created
+
+
+if __name__ == "__main__":
+    from main import engine
+    upgrade(engine)
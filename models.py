@@ -1,5 +1,5 @@
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, JSON, Index
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, ForeignKey, JSON, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -17,6 +17,11 @@ class Venue(Base):
     sname = Column(String(50), nullable=False)
     status = Column(Integer)
     
+    __table_args__ = (
+        # get_available_venues / check_data_exists 按服务、日期和状态查询
+        Index("ix_venues_serviceid_date_status", "serviceid", "date", "status"),
+    )
+    
 class BookingRecord(Base):
     __tablename__ = "bookings"
     id = Column(Integer, primary_key=True)
@@ -42,7 +47,7 @@ class AutoBooking(Base):
     __tablename__ = "auto_bookings"
     
     id = Column(Integer, primary_key=True)
-    venue_id = Column(Integer, nullable=False)
+    venue_id = Column(Integer, ForeignKey("venues.id"), nullable=False)
     account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
     booking_date = Column(String(10), nullable=False)
     time_no = Column(String(15), nullable=False)
@@ -53,5 +58,84 @@ class AutoBooking(Base):
     executed_at = Column(DateTime)
     result = Column(JSON)
     
+    __table_args__ = (
+        # get_bookings_to_execute 按状态和执行时间查询到期任务
+        Index("ix_auto_bookings_status_scheduled_time", "status", "scheduled_time"),
+        # get_bookings 按 (scheduled_time, id) 倒序做游标分页
+        Index("ix_auto_bookings_scheduled_time_id", "scheduled_time", "id"),
+    )
+    
     # 关联账号
-    account = relationship("Account", back_populates="auto_bookings")
\ No newline at end of file
+    account = relationship("Account", back_populates="auto_bookings")
+    # 关联场馆
+    venue = relationship("Venue")
+    # 备选场馆，按优先级排序
+    candidates = relationship(
+        "AutoBookingCandidate",
+        back_populates="booking",
+        order_by="AutoBookingCandidate.rank",
+        cascade="all, delete-orphan"
+    )
+    # 执行时间线
+    attempts = relationship(
+        "AutoBookingAttempt",
+        back_populates="booking",
+        order_by="AutoBookingAttempt.started",
+        cascade="all, delete-orphan"
+    )
+
+class AutoBookingCandidate(Base):
+    __tablename__ = "auto_booking_candidates"
+    
+    id = Column(Integer, primary_key=True)
+    booking_id = Column(Integer, ForeignKey("auto_bookings.id"), nullable=False, index=True)
+    venue_id = Column(Integer, nullable=False)
+    rank = Column(Integer, nullable=False)  # 数字越小优先级越高，主场馆 venue_id 不在此表中
+    
+    booking = relationship("AutoBooking", back_populates="candidates")
+
+class AutoBookingAttempt(Base):
+    """任务执行时间线中的一个事件，时间为相对触发时刻的秒数（单调时钟），准备阶段的登录为负数"""
+    __tablename__ = "auto_booking_attempts"
+    
+    id = Column(Integer, primary_key=True)
+    booking_id = Column(Integer, ForeignKey("auto_bookings.id"), nullable=False, index=True)
+    event = Column(String(10), nullable=False)  # fire, login, reuse, post
+    venue_id = Column(Integer)
+    attempt = Column(Integer)  # 同一场馆的第几次 POST
+    started = Column(Float, nullable=False)  # 登录开始 / 请求发出
+    finished = Column(Float)  # 登录结束 / 收到响应
+    outcome = Column(String(20))  # success, not_open, daily_limit, other_error, http_error
+    message = Column(String(200))  # 服务器返回的 message
+    server_offset_ms = Column(Float)  # fire 事件记录触发时估计的服务器时钟偏差
+    
+    booking = relationship("AutoBooking", back_populates="attempts")
+
+class ImportManifest(Base):
+    __tablename__ = "import_manifest"
+    
+    id = Column(Integer, primary_key=True)
+    path = Column(String(255), nullable=False, unique=True)
+    size = Column(Integer, nullable=False)
+    mtime = Column(Float, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    imported_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    result = Column(JSON)  # 最近一次导入的行数和耗时
+
+class VenueStatusChange(Base):
+    """场馆状态变化日志，只追加不修改"""
+    __tablename__ = "venue_status_changes"
+    
+    id = Column(Integer, primary_key=True)
+    original_id = Column(Integer, nullable=False, index=True)
+    serviceid = Column(Integer, nullable=False)
+    date = Column(String(10), nullable=False)
+    time_no = Column(String(15))
+    sname = Column(String(50))
+    old_status = Column(Integer)  # 新出现的场馆为空
+    new_status = Column(Integer)
+    changed_at = Column(DateTime, default=datetime.now, nullable=False)
+    
+    __table_args__ = (
+        Index("ix_venue_status_changes_serviceid_date_changed_at", "serviceid", "date", "changed_at"),
+    )
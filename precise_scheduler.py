@@ -0,0 +1,141 @@
+"""
+精确定时器
+基于最小堆的进程内定时器，运行在事件循环上：
+- 按单调时钟计算截止时间，只在下一个截止时间醒来，不做轮询
+- 最后 Config.SCHEDULER_SPIN 秒改为忙等，获得亚毫秒级的触发精度
+- 任务新增或取消时立即唤醒，重新计算下一个截止时间
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime
+from config import Config
+from metrics import SCHEDULER_LATENESS_SECONDS, SCHEDULED_TASKS
+
+
+class _Entry:
+    __slots__ = ("deadline", "seq", "key", "func", "args", "cancelled")
+
+    def __init__(self, deadline, seq, key, func, args):
+        self.deadline = deadline
+        self.seq = seq
+        self.key = key
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.deadline, self.seq) < (other.deadline, other.seq)
+
+
+class PreciseScheduler:
+    """最小堆定时器，到期时在事件循环中以后台任务运行协程函数
+
+    schedule_at/cancel 可以从任意线程调用
+    """
+
+    def __init__(self, spin: float = None):
+        self.spin = Config.SCHEDULER_SPIN if spin is None else spin
+        self._heap = []
+        self._entries = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+        self._tasks = set()
+
+    def _notify(self):
+        """唤醒运行中的调度循环"""
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+    def schedule_at(self, key, when: datetime, func, *args):
+        """在本地时间 when 运行 func(*args)，相同 key 的旧计划会被替换"""
+        deadline = time.monotonic() + (when - datetime.now()).total_seconds()
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None:
+                old.cancelled = True
+            entry = _Entry(deadline, next(self._seq), key, func, args)
+            self._entries[key] = entry
+            heapq.heappush(self._heap, entry)
+        self._notify()
+
+    def cancel(self, key) -> bool:
+        """取消计划，返回是否存在该计划"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return False
+            entry.cancelled = True
+        self._notify()
+        return True
+
+    def pending(self, phase: str = None) -> int:
+        """等待中的计划数，传入 phase 时只统计键为 (..., phase) 的计划"""
+        with self._lock:
+            if phase is None:
+                return len(self._entries)
+            return sum(1 for key in self._entries if isinstance(key, tuple) and key[-1] == phase)
+
+    def _next_deadline(self):
+        with self._lock:
+            while self._heap and self._heap[0].cancelled:
+                heapq.heappop(self._heap)
+            return self._heap[0].deadline if self._heap else None
+
+    def _pop_due(self, now: float):
+        due = []
+        with self._lock:
+            while self._heap and (self._heap[0].cancelled or self._heap[0].deadline <= now):
+                entry = heapq.heappop(self._heap)
+                if entry.cancelled:
+                    continue
+                if self._entries.get(entry.key) is entry:
+                    del self._entries[entry.key]
+                due.append(entry)
+        return due
+
+    def _fire(self, entry: _Entry):
+        phase = entry.key[-1] if isinstance(entry.key, tuple) else entry.key
+        SCHEDULER_LATENESS_SECONDS.observe(time.monotonic() - entry.deadline, phase=phase)
+        task = self._loop.create_task(entry.func(*entry.args))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def run(self):
+        """在当前事件循环中运行调度，直到被取消"""
+        self._wakeup = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        try:
+            while True:
+                self._wakeup.clear()
+                deadline = self._next_deadline()
+                if deadline is None:
+                    await self._wakeup.wait()
+                    continue
+
+                remaining = deadline - time.monotonic()
+                if remaining > self.spin:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), remaining - self.spin)
+                    except asyncio.TimeoutError:
+                        pass
+                    # 被唤醒或快到期时重新检查堆顶，期间可能有新增或取消
+                    continue
+
+                # 最后一小段忙等，避免事件循环定时器的毫秒级误差
+                while time.monotonic() < deadline:
+                    pass
+                for entry in self._pop_due(time.monotonic()):
+                    self._fire(entry)
+        finally:
+            self._loop = None
+
+
+# 进程内共享的预约任务定时器
+booking_scheduler = PreciseScheduler()
+SCHEDULED_TASKS.set_function(lambda: booking_scheduler.pending("fire"))
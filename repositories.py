@@ -1,20 +1,28 @@
+import logging
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
-from models import Venue, BookingRecord, Account, AutoBooking  # 修改导入来源
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import and_, or_, update, insert, func
+from models import Venue, BookingRecord, Account, AutoBooking, AutoBookingCandidate, AutoBookingAttempt, VenueStatusChange  # 修改导入来源
+from config import Config
+from metrics import instrument_repository
+from clock_sync import server_clock
 
+logger = logging.getLogger(__name__)
+
+@instrument_repository
 class VenueRepository:
     def __init__(self, db: Session):
         self.db = db
         
     def get_available_venues(self, serviceid: int, date: str):
-        print(f"查询参数 serviceid={serviceid}, date={date}")  # 添加参数日志
         query = self.db.query(Venue).filter(
             Venue.serviceid == serviceid,
             Venue.date == date,
             Venue.status == 1
         )
-        print(f"生成SQL: {str(query)}")  # 输出实际执行的SQL
+        # 编译 SQL 字符串有开销，只在开启 DEBUG 时输出
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("查询参数 serviceid=%s, date=%s, SQL: %s", serviceid, date, str(query))
         return query.all()
 
     # 新增批量创建方法
@@ -33,6 +41,30 @@ class VenueRepository:
         """通过ID获取场馆"""
         return self.db.query(Venue).filter(Venue.id == venue_id).first()
 
+    def get_venues_by_ids(self, venue_ids: list):
+        """批量获取场馆"""
+        return self.db.query(Venue).filter(Venue.id.in_(venue_ids)).all()
+
+@instrument_repository
+class VenueStatusChangeRepository:
+    def __init__(self, db: Session):
+        self.db = db
+        
+    def get_changes(self, serviceid: int = None, date: str = None, since: datetime = None, limit: int = None):
+        """按时间从新到旧获取场馆状态变化"""
+        query = self.db.query(VenueStatusChange)
+        if serviceid is not None:
+            query = query.filter(VenueStatusChange.serviceid == serviceid)
+        if date:
+            query = query.filter(VenueStatusChange.date == date)
+        if since:
+            query = query.filter(VenueStatusChange.changed_at >= since)
+        query = query.order_by(VenueStatusChange.changed_at.desc(), VenueStatusChange.id.desc())
+        if limit:
+            query = query.limit(limit)
+        return query.all()
+
+@instrument_repository
 class BookingRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -47,6 +79,7 @@ class BookingRepository:
         self.db.commit()
         return record
         
+@instrument_repository
 class AccountRepository:
     def __init__(self, db: Session):
         self.db = db
@@ -73,9 +106,26 @@ class AccountRepository:
         self.db.refresh(account)
         return account
         
-    def get_accounts(self):
-        """获取所有账号"""
-        return self.db.query(Account).all()
+    def get_accounts(self, limit: int = None, cursor: str = None):
+        """按 ID 升序获取账号，返回 (账号列表, 下一页游标)
+
+        cursor 为上一页返回的游标；limit 为空时返回全部，游标为 None
+        """
+        query = self.db.query(Account).order_by(Account.id)
+        if cursor:
+            query = query.filter(Account.id > int(cursor))
+        if limit is None:
+            return query.all(), None
+        # 多取一条判断是否还有下一页
+        accounts = query.limit(limit + 1).all()
+        if len(accounts) <= limit:
+            return accounts, None
+        accounts = accounts[:limit]
+        return accounts, str(accounts[-1].id)
+        
+    def count_accounts(self) -> int:
+        """账号总数"""
+        return self.db.query(func.count(Account.id)).scalar()
         
     def get_account_by_id(self, account_id: int):
         """通过ID获取账号"""
@@ -116,20 +166,22 @@ class AccountRepository:
         """获取默认账号"""
         return self.db.query(Account).filter(Account.isDefault == True).first()
         
+@instrument_repository
 class AutoBookingRepository:
     def __init__(self, db: Session):
         self.db = db
         
-    def create_booking(self, venue_id: int, account_id: int, booking_date: str, time_no: str, users: str):
-        """创建自动预约任务"""
-        # 计算预约执行时间（前一天的8:00:05）
+    def create_booking(self, venue_id: int, account_id: int, booking_date: str, time_no: str, users: str,
+                       candidate_venue_ids: list = None):
+        """创建自动预约任务，candidate_venue_ids 为按优先级排序的备选场馆"""
+        # 计算预约执行时间（前一天的 Config.AUTO_BOOKING_TIME，按服务器时间）
         booking_date_obj = datetime.strptime(booking_date, "%Y-%m-%d")
         scheduled_day = booking_date_obj - timedelta(days=1)
         scheduled_time = datetime(
             scheduled_day.year, 
             scheduled_day.month, 
             scheduled_day.day, 
-            8, 0, 5
+            *Config.AUTO_BOOKING_TIME
         )
         
         booking = AutoBooking(
@@ -141,29 +193,94 @@ class AutoBookingRepository:
             scheduled_time=scheduled_time,
             status="pending"
         )
+        # 备选场馆去重，且不包含主场馆
+        seen = {venue_id}
+        for candidate_id in candidate_venue_ids or []:
+            if candidate_id in seen:
+                continue
+            seen.add(candidate_id)
+            booking.candidates.append(AutoBookingCandidate(venue_id=candidate_id, rank=len(seen) - 1))
         
         self.db.add(booking)
         self.db.commit()
         self.db.refresh(booking)
         return booking
         
-    def get_bookings(self, status: str = None):
-        """获取预约任务列表"""
-        query = self.db.query(AutoBooking)
+    def _filter_bookings(self, query, status: str = None, account_id: int = None,
+                         date_from: str = None, date_to: str = None):
+        """按状态、账号和预约日期范围（含两端，YYYY-MM-DD）筛选"""
         if status:
             query = query.filter(AutoBooking.status == status)
-        return query.all()
+        if account_id is not None:
+            query = query.filter(AutoBooking.account_id == account_id)
+        if date_from:
+            query = query.filter(AutoBooking.booking_date >= date_from)
+        if date_to:
+            query = query.filter(AutoBooking.booking_date <= date_to)
+        return query
+        
+    def get_bookings(self, status: str = None, account_id: int = None, date_from: str = None,
+                     date_to: str = None, limit: int = None, cursor: str = None):
+        """按执行时间从新到旧获取预约任务，场馆、账号和备选场馆一并加载，返回 (任务列表, 下一页游标)
+
+        游标由上一页最后一条的 (scheduled_time, id) 组成，翻页时直接定位，不使用 OFFSET；
+        limit 为空时返回全部，游标为 None
+        """
+        query = self.db.query(AutoBooking).options(
+            joinedload(AutoBooking.venue),
+            joinedload(AutoBooking.account),
+            selectinload(AutoBooking.candidates)
+        )
+        query = self._filter_bookings(query, status, account_id, date_from, date_to)
+        if cursor:
+            scheduled_time, booking_id = cursor.rsplit("|", 1)
+            scheduled_time, booking_id = datetime.fromisoformat(scheduled_time), int(booking_id)
+            query = query.filter(or_(
+                AutoBooking.scheduled_time < scheduled_time,
+                and_(AutoBooking.scheduled_time == scheduled_time, AutoBooking.id < booking_id)
+            ))
+        query = query.order_by(AutoBooking.scheduled_time.desc(), AutoBooking.id.desc())
+        if limit is None:
+            return query.all(), None
+        # 多取一条判断是否还有下一页
+        bookings = query.limit(limit + 1).all()
+        if len(bookings) <= limit:
+            return bookings, None
+        bookings = bookings[:limit]
+        last = bookings[-1]
+        return bookings, f"{last.scheduled_time.isoformat()}|{last.id}"
+        
+    def count_bookings(self, status: str = None, account_id: int = None,
+                       date_from: str = None, date_to: str = None) -> int:
+        """符合筛选条件的任务总数，只在数据库中计数"""
+        query = self._filter_bookings(
+            self.db.query(func.count(AutoBooking.id)), status, account_id, date_from, date_to
+        )
+        return query.scalar()
         
     def get_booking_by_id(self, booking_id: int):
         """通过ID获取预约任务"""
         return self.db.query(AutoBooking).filter(AutoBooking.id == booking_id).first()
         
+    def get_pending_bookings_by_ids(self, booking_ids: list):
+        """批量获取待执行的任务，账号和备选场馆一并加载"""
+        return self.db.query(AutoBooking).options(
+            joinedload(AutoBooking.account),
+            selectinload(AutoBooking.candidates)
+        ).filter(
+            AutoBooking.id.in_(booking_ids),
+            AutoBooking.status == "pending"
+        ).all()
+        
     def get_bookings_to_execute(self):
-        """获取需要执行的预约任务（时间到了且状态为pending）"""
-        now = datetime.now()
+        """获取需要执行的预约任务（时间到了且状态为pending）
+
+        scheduled_time 为服务器时间，按时钟校准结果换算：现在发出的请求到达服务器时已到执行时间才算到期
+        """
+        due = server_clock.from_local(datetime.now())
         return self.db.query(AutoBooking).filter(
             AutoBooking.status == "pending",
-            AutoBooking.scheduled_time <= now
+            AutoBooking.scheduled_time <= due
         ).all()
         
     def get_all_pending_bookings(self):
@@ -187,6 +304,36 @@ class AutoBookingRepository:
         self.db.refresh(booking)
         return booking
         
+    def bulk_update_status(self, updates: list, attempts: list = None):
+        """在一个事务中写回一批任务的执行结果，updates 为 (booking_id, status, result) 列表，
+        attempts 为同时写入的执行时间线（auto_booking_attempts 表的行）
+        """
+        if not updates:
+            return 0
+        now = datetime.now()
+        self.db.execute(update(AutoBooking), [
+            {"id": booking_id, "status": status, "result": result, "executed_at": now}
+            for booking_id, status, result in updates
+        ])
+        if attempts:
+            self.db.execute(insert(AutoBookingAttempt), attempts)
+        self.db.commit()
+        return len(updates)
+
+    def get_attempts(self, booking_id: int):
+        """任务的执行时间线，按开始时刻排序"""
+        return self.db.query(AutoBookingAttempt).filter(
+            AutoBookingAttempt.booking_id == booking_id
+        ).order_by(AutoBookingAttempt.started, AutoBookingAttempt.id).all()
+
+    def get_attempts_executed_on(self, date: str):
+        """某天执行的所有任务的时间线，date 为 YYYY-MM-DD（执行日期，即预约日期的前一天）"""
+        start = datetime.strptime(date, "%Y-%m-%d")
+        return self.db.query(AutoBookingAttempt).join(AutoBooking).filter(
+            AutoBooking.executed_at >= start,
+            AutoBooking.executed_at < start + timedelta(days=1)
+        ).all()
+        
     def cancel_booking(self, booking_id: int):
         """取消预约任务"""
         booking = self.get_booking_by_id(booking_id)
@@ -0,0 +1,215 @@
+"""
+预约重试引擎
+按服务器返回的 message 对结果分类，按配置的节奏重试，并记录每次尝试的耗时
+"""
+import asyncio
+import logging
+import time
+from config import Config
+from metrics import BOOKING_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+# 结果分类
+SUCCESS = "success"    # 预约成功，停止
+RETRY = "retry"        # 可重试（未到预订时间、服务器繁忙、网络和 HTTP 错误）
+FAILURE = "failure"    # 终止失败（每日限约一场、场地已被预约、参数错误等其他 message）
+CANCELLED = "cancelled"  # 同组其他请求已有结果，主动停止
+
+NOT_OPEN_MESSAGE = '未到该日期的预订时间'
+DAILY_LIMIT_MESSAGE = '每日限预约一场'
+
+
+class RetryableError(Exception):
+    """单次尝试失败但可以重试（HTTP 错误、会话失效、连接异常等）"""
+
+
+def classify_result(result: dict) -> str:
+    """根据服务器返回的 result/message 判断结果类别
+
+    只有未到预订时间和 Config.RETRY_BUSY_MESSAGES 中的 message 会重试，其余一律视为终止失败，
+    避免对已被预约或参数有误的场馆反复请求；网络和 HTTP 错误由 RetryableError 表示，同样重试
+    """
+    if str(result.get('result')) == '1':
+        return SUCCESS
+    message = result.get('message') or ''
+    if NOT_OPEN_MESSAGE in message or any(text in message for text in Config.RETRY_BUSY_MESSAGES):
+        return RETRY
+    return FAILURE
+
+
+def outcome_class(result: dict = None, error: Exception = None) -> str:
+    """单次尝试的结果细分，用于指标统计: success、not_open、daily_limit、other_error、http_error"""
+    if error is not None:
+        return "http_error"
+    if str(result.get('result')) == '1':
+        return "success"
+    message = result.get('message') or ''
+    if NOT_OPEN_MESSAGE in message:
+        return "not_open"
+    if DAILY_LIMIT_MESSAGE in message:
+        return "daily_limit"
+    return "other_error"
+
+
+class RetryPolicy:
+    """重试节奏：开放时刻附近密集重试，之后指数退避，直到截止时间或次数上限"""
+
+    def __init__(self, burst_interval=None, burst_window=None, backoff_base=None,
+                 backoff_max=None, deadline=None, max_attempts=None):
+        self.burst_interval = Config.RETRY_BURST_INTERVAL if burst_interval is None else burst_interval
+        self.burst_window = Config.RETRY_BURST_WINDOW if burst_window is None else burst_window
+        self.backoff_base = Config.RETRY_BACKOFF_BASE if backoff_base is None else backoff_base
+        self.backoff_max = Config.RETRY_BACKOFF_MAX if backoff_max is None else backoff_max
+        self.deadline = Config.RETRY_DEADLINE if deadline is None else deadline
+        self.max_attempts = Config.RETRY_MAX_ATTEMPTS if max_attempts is None else max_attempts
+
+    def next_delay(self, elapsed: float, backoff_attempts: int) -> float:
+        """计算下一次尝试前的等待时间
+
+        elapsed 为距第一次尝试开始的秒数，backoff_attempts 为进入退避阶段后已失败的次数
+        """
+        if elapsed < self.burst_window:
+            return self.burst_interval
+        return min(self.backoff_base * (2 ** backoff_attempts), self.backoff_max)
+
+
+class AttemptRecord:
+    """单次尝试的记录，时间均为相对引擎启动的秒数（单调时钟）"""
+
+    def __init__(self, number: int, started: float):
+        self.number = number
+        self.started = started
+        self.elapsed = None
+        self.outcome = None
+        self.message = None
+
+    def to_dict(self) -> dict:
+        return {
+            "attempt": self.number,
+            "started": round(self.started, 4),
+            "elapsed": round(self.elapsed, 4),
+            "outcome": self.outcome,
+            "message": self.message,
+        }
+
+
+class _RetryRun:
+    """一次重试流程的状态，同步和异步执行共用"""
+
+    def __init__(self, policy: RetryPolicy, context: dict = None):
+        self.policy = policy
+        self.context = context or {}
+        self.attempts = []
+        self.start = time.monotonic()
+        self.backoff_attempts = 0
+        self.outcome = RETRY
+        self.message = None
+        self.result = None
+
+    def begin(self) -> AttemptRecord:
+        return AttemptRecord(len(self.attempts) + 1, time.monotonic() - self.start)
+
+    def stop(self):
+        """外部要求停止（并发的其他请求已经成功或触发每日限制）"""
+        self.outcome = CANCELLED
+        self.message = "已停止：同组其他请求已有结果"
+
+    def finish(self, record: AttemptRecord, result: dict = None, error: Exception = None):
+        """记录一次尝试的结果，返回下一次尝试前的等待秒数，不再重试时返回 None"""
+        if error is not None:
+            self.result = None
+            self.outcome = RETRY
+            self.message = str(error)
+        else:
+            self.result = result
+            self.outcome = classify_result(result)
+            self.message = result.get('message')
+        record.elapsed = time.monotonic() - self.start - record.started
+        record.outcome = self.outcome
+        record.message = self.message
+        self.attempts.append(record)
+        BOOKING_ATTEMPTS.inc(outcome=outcome_class(result, error))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("第 %d 次尝试: %s %s", record.number, self.outcome, self.message, extra={
+                **self.context,
+                "attempt": record.number,
+                "attempt_started": round(record.started, 4),
+                "attempt_elapsed": round(record.elapsed, 4),
+                "outcome": self.outcome,
+            })
+
+        if self.outcome != RETRY:
+            return None
+
+        elapsed = time.monotonic() - self.start
+        delay = self.policy.next_delay(elapsed, self.backoff_attempts)
+        if elapsed >= self.policy.burst_window:
+            self.backoff_attempts += 1
+        if len(self.attempts) >= self.policy.max_attempts or elapsed + delay > self.policy.deadline:
+            self.outcome = FAILURE
+            self.message = f"重试结束（{len(self.attempts)} 次）：{self.message}"
+            return None
+        return delay
+
+    def summary(self) -> dict:
+        return {
+            "success": self.outcome == SUCCESS,
+            "outcome": self.outcome,
+            "message": self.message,
+            "response": self.result,
+            "elapsed": round(time.monotonic() - self.start, 4),
+            "attempts": [record.to_dict() for record in self.attempts],
+        }
+
+
+class RetryEngine:
+    """执行一次完整的预约重试流程，每次调用 run 都使用独立的尝试状态"""
+
+    def __init__(self, policy: RetryPolicy = None, context: dict = None):
+        """context 为附加到每条尝试日志的字段（task_id、account 等）"""
+        self.policy = policy or RetryPolicy()
+        self.context = context
+
+    def run(self, send, stop=None) -> dict:
+        """反复调用 send() 直到成功、终止失败、超过截止时间或次数上限
+
+        send 返回服务器的 JSON 结果，或抛出 RetryableError 表示本次可重试；
+        stop 为可选的 Event，被设置后不再发起新的尝试
+        """
+        state = _RetryRun(self.policy, self.context)
+        while True:
+            if stop is not None and stop.is_set():
+                state.stop()
+                return state.summary()
+            record = state.begin()
+            try:
+                delay = state.finish(record, result=send())
+            except RetryableError as e:
+                delay = state.finish(record, error=e)
+            if delay is None:
+                return state.summary()
+            time.sleep(delay)
+
+    async def run_async(self, send, stop=None) -> dict:
+        """run 的异步版本，send 为返回 JSON 结果的协程函数，stop 为 asyncio.Event"""
+        state = _RetryRun(self.policy, self.context)
+        while True:
+            if stop is not None and stop.is_set():
+                state.stop()
+                return state.summary()
+            record = state.begin()
+            try:
+                delay = state.finish(record, result=await send())
+            except RetryableError as e:
+                delay = state.finish(record, error=e)
+            if delay is None:
+                return state.summary()
+            if stop is None:
+                await asyncio.sleep(delay)
+                continue
+            # 等待期间收到停止信号立即结束，已发出的请求不受影响
+            try:
+                await asyncio.wait_for(stop.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
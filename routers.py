@@ -1,13 +1,26 @@
 from sqlalchemy.orm import Session  # 添加 Session 类型导入
-from fastapi import APIRouter, Depends, HTTPException, Body
-from dependencies import get_db
-from repositories import VenueRepository, BookingRepository, AccountRepository, AutoBookingRepository
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Response
+from dependencies import (
+    get_db, get_venue_repo, get_booking_repo, get_account_repo, get_auto_booking_repo,
+    get_venue_status_change_repo, pool_status
+)
+from repositories import VenueRepository, BookingRepository, AccountRepository, AutoBookingRepository, VenueStatusChangeRepository
+from clock_sync import server_clock
+from availability_cache import availability_cache
+from async_book import AsyncBooking
+from attempt_timeline import attempt_to_dict, summarize
+from config import Config
 from typing import List, Optional
 from pydantic import BaseModel, Field
-import json
+import asyncio
+import logging
 from datetime import datetime
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# 只访问数据库（或只调用阻塞的 requests）的路由声明为普通 def，由 FastAPI 放到线程池执行，不阻塞事件循环；
+# async def 路由内只能 await 异步操作，阻塞调用需放到 asyncio.to_thread 中
 
 # 数据模型
 class AccountCreate(BaseModel):
@@ -35,6 +48,7 @@ class AutoBookingCreate(BaseModel):
     booking_date: str
     time_no: str
     users: str
+    candidate_venue_ids: List[int] = []  # 按优先级排序的备选场馆，主场馆约满时同时尝试
 
 class AutoBookingResponse(BaseModel):
     id: int
@@ -50,6 +64,7 @@ class AutoBookingResponse(BaseModel):
     result: Optional[dict] = None
     venue: Optional[dict] = None
     account: Optional[dict] = None
+    candidate_venue_ids: List[int] = []
 
 class PrebookWithAccount(BaseModel):
     stockid: str
@@ -59,39 +74,40 @@ class PrebookWithAccount(BaseModel):
     account_id: int
 
 # 场馆查询接口增加参数校验
-# 修改所有仓库实例的获取方式
 @router.get("/venues")
 async def get_venues(
     serviceid: int, 
     date: str,
-    db: Session = Depends(get_db)
+    refresh: bool = False
 ):
-    from fetch_data import FetchData, DataImporter  # 新增导入
-    
-    repo = VenueRepository(db)
-    
-    # 检查数据库是否存在该日期的数据
-    if not repo.check_data_exists(serviceid, date):
-        print(f"数据库无 {date} 数据，开始获取...")
-        # 调用API获取数据
-        api_data = FetchData.fetch_service_data(date, serviceid)
-        if api_data:
-            # 保存并导入数据
-            FetchData.save_data_to_json(api_data, date, serviceid)
-            DataImporter(db).import_from_json(
-                f"data/service_data_{serviceid}_{date}.json"
-            )
-    
+    """获取可用场馆，结果按 (serviceid, date) 缓存，refresh=true 时强制从源系统刷新"""
     if not serviceid or not date:
         raise HTTPException(400, "Missing required parameters")
-    return repo.get_available_venues(serviceid, date)
+    return await availability_cache.get(serviceid, date, refresh=refresh)
+
+@router.get("/venue-changes")
+def get_venue_changes(
+    serviceid: Optional[int] = None,
+    date: Optional[str] = None,
+    since: Optional[datetime] = None,
+    limit: int = Query(Config.PAGE_SIZE, ge=1, le=Config.PAGE_SIZE_MAX),
+    repo: VenueStatusChangeRepository = Depends(get_venue_status_change_repo)
+):
+    """后台轮询记录的场馆状态变化（old_status 为空表示新出现的场馆），按时间从新到旧"""
+    return repo.get_changes(serviceid=serviceid, date=date, since=since, limit=limit)
+
+@router.get("/venue-poller")
+async def get_venue_poller():
+    """后台轮询的运行状态"""
+    from availability_poller import availability_poller
+    return availability_poller.status()
 
 # 预约接口增加事务处理
 @router.post("/bookings")
-async def create_booking(
+def create_booking(
     venue_id: int,
     users: list,
-    repo: BookingRepository = Depends(lambda: BookingRepository(next(get_db())))
+    repo: BookingRepository = Depends(get_booking_repo)
 ):
     try:
         return repo.create_booking(venue_id, users)
@@ -100,9 +116,9 @@ async def create_booking(
 
 # 账号管理API
 @router.post("/accounts", status_code=201, response_model=AccountResponse)
-async def create_account(
+def create_account(
     account: AccountCreate,
-    repo: AccountRepository = Depends(lambda: AccountRepository(next(get_db())))
+    repo: AccountRepository = Depends(get_account_repo)
 ):
     """创建新账号"""
     new_account = repo.create_account(
@@ -118,16 +134,32 @@ async def create_account(
     return new_account
 
 @router.get("/accounts", response_model=List[AccountResponse])
-async def get_accounts(
-    repo: AccountRepository = Depends(lambda: AccountRepository(next(get_db())))
+def get_accounts(
+    response: Response,
+    limit: int = Query(Config.PAGE_SIZE, ge=1, le=Config.PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
+    repo: AccountRepository = Depends(get_account_repo)
 ):
-    """获取所有账号"""
-    return repo.get_accounts()
+    """分页获取账号，下一页游标放在 X-Next-Cursor 响应头中，没有下一页时不返回该头"""
+    try:
+        accounts, next_cursor = repo.get_accounts(limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(400, "无效的游标")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return accounts
+
+@router.get("/accounts/count")
+def count_accounts(
+    repo: AccountRepository = Depends(get_account_repo)
+):
+    """账号总数"""
+    return {"total": repo.count_accounts()}
 
 @router.get("/accounts/{account_id}", response_model=AccountResponse)
-async def get_account(
+def get_account(
     account_id: int,
-    repo: AccountRepository = Depends(lambda: AccountRepository(next(get_db())))
+    repo: AccountRepository = Depends(get_account_repo)
 ):
     """获取特定账号"""
     account = repo.get_account_by_id(account_id)
@@ -136,10 +168,10 @@ async def get_account(
     return account
 
 @router.put("/accounts/{account_id}", response_model=AccountResponse)
-async def update_account(
+def update_account(
     account_id: int,
     account: AccountUpdate,
-    repo: AccountRepository = Depends(lambda: AccountRepository(next(get_db())))
+    repo: AccountRepository = Depends(get_account_repo)
 ):
     """更新账号信息"""
     updated = repo.update_account(
@@ -155,9 +187,9 @@ async def update_account(
     return updated
 
 @router.delete("/accounts/{account_id}", status_code=204)
-async def delete_account(
+def delete_account(
     account_id: int,
-    repo: AccountRepository = Depends(lambda: AccountRepository(next(get_db())))
+    repo: AccountRepository = Depends(get_account_repo)
 ):
     """删除账号"""
     result = repo.delete_account(account_id)
@@ -166,12 +198,33 @@ async def delete_account(
     return None
 
 # 自动预约API
+def _auto_booking_response(booking) -> dict:
+    """把预约任务及其关联的场馆、账号信息转换为响应字典（通过关系属性读取，不单独查询）"""
+    response_dict = booking.__dict__.copy()
+    response_dict["candidate_venue_ids"] = [c.venue_id for c in booking.candidates]
+    
+    venue = booking.venue
+    response_dict["venue"] = {
+        "id": venue.id,
+        "sname": venue.sname,
+        "time_no": venue.time_no
+    } if venue else None
+    
+    account = booking.account
+    response_dict["account"] = {
+        "id": account.id,
+        "username": account.username,
+        "remark": account.remark
+    } if account else None
+    
+    return response_dict
+
 @router.post("/auto-bookings", status_code=201, response_model=AutoBookingResponse)
-async def create_auto_booking(
+def create_auto_booking(
     booking: AutoBookingCreate,
-    repo: AutoBookingRepository = Depends(lambda: AutoBookingRepository(next(get_db()))),
-    venue_repo: VenueRepository = Depends(lambda: VenueRepository(next(get_db()))),
-    account_repo: AccountRepository = Depends(lambda: AccountRepository(next(get_db())))
+    repo: AutoBookingRepository = Depends(get_auto_booking_repo),
+    venue_repo: VenueRepository = Depends(get_venue_repo),
+    account_repo: AccountRepository = Depends(get_account_repo)
 ):
     """创建自动预约任务"""
     # 验证场馆存在
@@ -179,6 +232,13 @@ async def create_auto_booking(
     if not venue:
         raise HTTPException(404, "场馆不存在")
     
+    # 验证备选场馆存在
+    if booking.candidate_venue_ids:
+        found = {v.id for v in venue_repo.get_venues_by_ids(booking.candidate_venue_ids)}
+        missing = [venue_id for venue_id in booking.candidate_venue_ids if venue_id not in found]
+        if missing:
+            raise HTTPException(404, f"备选场馆不存在: {missing}")
+    
     # 验证账号存在
     account = account_repo.get_account_by_id(booking.account_id)
     if not account:
@@ -189,124 +249,132 @@ async def create_auto_booking(
         account_id=booking.account_id,
         booking_date=booking.booking_date,
         time_no=booking.time_no,
-        users=booking.users
+        users=booking.users,
+        candidate_venue_ids=booking.candidate_venue_ids
     )
     
-    # 将关联信息添加到响应中
-    response_dict = new_booking.__dict__.copy()
-    
-    response_dict["venue"] = {
-        "id": venue.id,
-        "sname": venue.sname,
-        "time_no": venue.time_no
-    }
-    
-    response_dict["account"] = {
-        "id": account.id,
-        "username": account.username,
-        "remark": account.remark
-    }
+    # 立即登记执行计划，不必等待执行器下一次同步
+    from auto_booker import AutoBooker
+    AutoBooker.schedule_task(new_booking.id, new_booking.scheduled_time)
     
-    return response_dict
+    # 将关联信息添加到响应中
+    return _auto_booking_response(new_booking)
 
 @router.get("/auto-bookings", response_model=List[AutoBookingResponse])
-async def get_auto_bookings(
+def get_auto_bookings(
+    response: Response,
     status: Optional[str] = None,
-    repo: AutoBookingRepository = Depends(lambda: AutoBookingRepository(next(get_db()))),
-    venue_repo: VenueRepository = Depends(lambda: VenueRepository(next(get_db()))),
-    account_repo: AccountRepository = Depends(lambda: AccountRepository(next(get_db())))
+    account_id: Optional[int] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = Query(Config.PAGE_SIZE, ge=1, le=Config.PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
+    repo: AutoBookingRepository = Depends(get_auto_booking_repo)
 ):
-    """获取自动预约任务列表"""
-    bookings = repo.get_bookings(status)
-    
-    # 为每个任务添加关联的场馆和账号信息
-    result = []
-    for booking in bookings:
-        booking_dict = booking.__dict__.copy()
-        
-        # 获取关联的场馆信息
-        venue = venue_repo.get_venue_by_id(booking.venue_id)
-        if venue:
-            booking_dict["venue"] = {
-                "id": venue.id,
-                "sname": venue.sname,
-                "time_no": venue.time_no
-            }
-        
-        # 获取关联的账号信息
-        account = account_repo.get_account_by_id(booking.account_id)
-        if account:
-            booking_dict["account"] = {
-                "id": account.id,
-                "username": account.username,
-                "remark": account.remark
-            }
-        
-        result.append(booking_dict)
+    """按执行时间从新到旧分页获取自动预约任务
+
+    可按状态、账号和预约日期范围筛选；下一页游标放在 X-Next-Cursor 响应头中，没有下一页时不返回该头
+    """
+    try:
+        bookings, next_cursor = repo.get_bookings(
+            status=status, account_id=account_id, date_from=date_from, date_to=date_to,
+            limit=limit, cursor=cursor
+        )
+    except ValueError:
+        raise HTTPException(400, "无效的游标")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
-    return result
+    # 场馆和账号信息已随列表一并加载
+    return [_auto_booking_response(booking) for booking in bookings]
+
+@router.get("/auto-bookings/count")
+def count_auto_bookings(
+    status: Optional[str] = None,
+    account_id: Optional[int] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    repo: AutoBookingRepository = Depends(get_auto_booking_repo)
+):
+    """符合筛选条件的自动预约任务总数"""
+    return {"total": repo.count_bookings(status=status, account_id=account_id, date_from=date_from, date_to=date_to)}
+
+@router.get("/auto-bookings/timeline-stats")
+def get_auto_booking_timeline_stats(
+    date: str,
+    repo: AutoBookingRepository = Depends(get_auto_booking_repo)
+):
+    """汇总某天执行的所有任务的时间线，返回首次发送、首个决定性响应、POST 耗时等的分位数（毫秒）"""
+    try:
+        attempts = repo.get_attempts_executed_on(date)
+    except ValueError:
+        raise HTTPException(400, "日期格式应为 YYYY-MM-DD")
+    return {"date": date, **summarize(attempts)}
 
 @router.get("/auto-bookings/{booking_id}", response_model=AutoBookingResponse)
-async def get_auto_booking(
+def get_auto_booking(
     booking_id: int,
-    repo: AutoBookingRepository = Depends(lambda: AutoBookingRepository(next(get_db()))),
-    venue_repo: VenueRepository = Depends(lambda: VenueRepository(next(get_db()))),
-    account_repo: AccountRepository = Depends(lambda: AccountRepository(next(get_db())))
+    repo: AutoBookingRepository = Depends(get_auto_booking_repo)
 ):
     """获取特定自动预约任务"""
     booking = repo.get_booking_by_id(booking_id)
     if not booking:
         raise HTTPException(404, "预约任务不存在")
     
-    # 获取关联的场馆和账号信息
-    venue = venue_repo.get_venue_by_id(booking.venue_id)
-    account = account_repo.get_account_by_id(booking.account_id)
-    
-    # 将关联信息添加到响应中
-    response_dict = booking.__dict__.copy()
-    
-    if venue:
-        response_dict["venue"] = {
-            "id": venue.id,
-            "sname": venue.sname,
-            "time_no": venue.time_no
-        }
-    
-    if account:
-        response_dict["account"] = {
-            "id": account.id,
-            "username": account.username,
-            "remark": account.remark
-        }
-    
-    return response_dict
+    return _auto_booking_response(booking)
+
+@router.get("/auto-bookings/{booking_id}/timeline")
+def get_auto_booking_timeline(
+    booking_id: int,
+    repo: AutoBookingRepository = Depends(get_auto_booking_repo)
+):
+    """任务的执行时间线：登录、每次 POST 的发送和响应时刻（相对触发时刻的毫秒数）及服务器 message"""
+    booking = repo.get_booking_by_id(booking_id)
+    if not booking:
+        raise HTTPException(404, "预约任务不存在")
+    return {
+        "task_id": booking.id,
+        "status": booking.status,
+        "scheduled_time": booking.scheduled_time,
+        "executed_at": booking.executed_at,
+        "events": [attempt_to_dict(attempt) for attempt in repo.get_attempts(booking_id)],
+    }
 
 @router.delete("/auto-bookings/{booking_id}", status_code=204)
-async def cancel_auto_booking(
+def cancel_auto_booking(
     booking_id: int,
-    repo: AutoBookingRepository = Depends(lambda: AutoBookingRepository(next(get_db())))
+    repo: AutoBookingRepository = Depends(get_auto_booking_repo)
 ):
     """取消自动预约任务"""
     result = repo.cancel_booking(booking_id)
     if not result:
         raise HTTPException(404, "预约任务不存在或已执行")
+    # 立即撤销执行计划和已准备的请求，避免取消后仍被触发
+    from auto_booker import AutoBooker
+    AutoBooker.unschedule_task(booking_id)
     return None
 
+@router.get("/clock")
+async def get_server_clock():
+    """服务器时钟偏差和单程延迟的当前估计"""
+    return server_clock.status()
+
 # 使用账号ID直接预约
 @router.post("/prebook-with-account")
 async def prebook_with_account(
     booking: PrebookWithAccount,
-    account_repo: AccountRepository = Depends(lambda: AccountRepository(next(get_db())))
+    account_repo: AccountRepository = Depends(get_account_repo)
 ):
     """使用指定账号直接预约"""
     # 获取账号信息
-    account = account_repo.get_account_by_id(booking.account_id)
+    account = await asyncio.to_thread(account_repo.get_account_by_id, booking.account_id)
     if not account:
         raise HTTPException(404, "账号不存在")
+    # 预约可能持续数秒，提前关闭会话归还连接（账号字段已加载）
+    await asyncio.to_thread(account_repo.db.close)
     
     try:
-        from book import Booking
-        book = Booking(
+        book = AsyncBooking(
             stockid=booking.stockid,
             serviceid=booking.serviceid,
             id=booking.venue_id,
@@ -314,91 +382,40 @@ async def prebook_with_account(
             username=account.username,
             password=account.password
         )
-        result = book.pre_book()
-        return {"status": "success", "result": result}
+        result = await book.pre_book()
+        return {"status": "success" if result["success"] else "failed", "result": result}
     except Exception as e:
         raise HTTPException(500, f"预约失败: {str(e)}")
 
 # 在router.py末尾添加
 @router.post("/import-data")
-async def import_data(
+def import_data(
     date: str,
     serviceid: int,
-    repo: VenueRepository = Depends(lambda: VenueRepository(next(get_db())))
+    db: Session = Depends(get_db)
 ):
     """触发式数据导入接口"""
-    from fetch_data import FetchData
-    print(f"[Import] Starting import for serviceid={serviceid} date={date}")
+    from fetch_data import FetchData, DataImporter
+    from json_stream import project_items
+    logger.info("开始导入 serviceid=%s date=%s", serviceid, date)
     
     data = FetchData.fetch_service_data(date, serviceid)
-    print(f"[Import] Received {len(data)} items from external API")
+    if not data:
+        raise HTTPException(502, "未能从源系统获取数据")
+    logger.info("从源系统获取到 %d 条数据", len(data))
+    
+    # 逐条裁剪字段后导入，已存在的场馆更新状态而不是重复插入
+    stats = DataImporter(db).import_items(project_items(data), serviceid=serviceid, date=date)
     
-    venues = []
-    for item in data:
-        # 强化空值校验
-        if not all([
-            item.get('stock'),
-            isinstance(item.get('id'), (int, str)),  # 允许字符串类型的ID
-            isinstance(item.get('stockid'), (int, str))
-        ]):
-            print(f"无效条目: {item.get('id')} | stockid={item.get('stockid')}")
-            continue
-
-        try:
-            # 添加类型转换保护
-            from models import Venue
-            venue = Venue(
-                original_id=int(item['id']),
-                serviceid=int(item['stock'].get('serviceid', serviceid)),
-                stockid=int(str(item['stockid']).strip()),  # 处理字符串类型的stockid
-                date=item['stock'].get('s_date', date).strip() or date,
-                time_no=item['stock'].get('time_no', '').replace(" ", "") or '00:00-24:00',
-                sname=item['sname'].strip(),
-                status=1 if item.get('status') == 1 else 0
-            )
-            # 字段完整性校验
-            if not all([venue.original_id, venue.serviceid, venue.stockid, venue.date, venue.time_no]):
-                print(f"无效数据条目: ID={item['id']}, 缺失关键字段")
-                continue
-            venues.append(venue)
-        except (KeyError, ValueError, TypeError) as e:
-            print(f"数据转换错误: {str(e)}, 原始数据: {item}")
-            continue
-
     # 添加空数据集校验
-    if not venues:
+    if not stats["valid"]:
         raise HTTPException(400, "导入数据全部无效，请检查原始数据格式")
     
-    # 添加空值检查
-    if any(not v.original_id for v in venues):
-        raise HTTPException(400, "发现无效的原始ID")
-    if venues:
-        sample = venues[0]
-        print(f"[Import] 字段验证: id={sample.original_id} | date={sample.date} | time_no={sample.time_no}")
-    # 添加字段类型验证
-    if venues:
-        invalid_dates = [v for v in venues if not isinstance(v.date, str) or len(v.date) != 10]
-        if invalid_dates:
-            print(f"[ERROR] 发现 {len(invalid_dates)} 条无效日期格式")
-    # 添加详细字段跟踪
-    if data:
-        print(f"[DEBUG] 原始数据第一条的stock字段: {json.dumps(data[0]['stock'], ensure_ascii=False)}")
-    # 添加详细字段验证
-    if venues:
-        stock_sample = data[0]['stock']
-        print(f"[Import] 字段源数据验证: serviceid={stock_sample.get('serviceid')} | date={stock_sample.get('s_date')} | time_no={stock_sample.get('time_no')}")
-    # 添加字段验证日志
-    if venues:
-        sample = venues[0]
-        print(f"[Import] 字段验证: date={sample.date} | time_no={sample.time_no} | stockid={sample.stockid}")
-    print(f"[Import] First venue sample: {venues[0].__dict__ if venues else 'No data'}")
-    
-    repo.bulk_create(venues)
-    return {"imported": len(venues)}
+    return {"imported": stats["inserted"] + stats["updated"], **stats}
 
 
 @router.get("/debug/connection")
-async def test_db_connection(db: Session = Depends(get_db)):
+def test_db_connection(db: Session = Depends(get_db)):
     """测试数据库连接"""
     try:
         result = db.execute("SELECT 1")
@@ -406,8 +423,13 @@ async def test_db_connection(db: Session = Depends(get_db)):
     except Exception as e:
         return {"error": str(e)}
 
+@router.get("/debug/pool")
+async def get_pool_status():
+    """数据库连接池状态，checkedout 为当前借出的连接数，负载下应保持平稳"""
+    return pool_status()
+
 @router.get("/debug/venues")
-async def debug_venues(
+def debug_venues(
     serviceid: int,
     date: str,
     db: Session = Depends(get_db)
@@ -433,8 +455,7 @@ async def prebook_venue(
 ):
     """直接预约接口（模拟new_order.py逻辑）"""
     try:
-        from book import Booking
-        book = Booking(
+        book = AsyncBooking(
             stockid=stockid,
             serviceid=serviceid,
             id=venue_id,
@@ -442,7 +463,7 @@ async def prebook_venue(
             username=username,
             password=password
         )
-        result = book.pre_book()
-        return {"status": "success", "result": result}
+        result = await book.pre_book()
+        return {"status": "success" if result["success"] else "failed", "result": result}
     except Exception as e:
-        raise HTTPException(500, f"预约失败: {str(e)}")
\ No newline at end of file
+        raise HTTPException(500, f"预约失败: {str(e)}")
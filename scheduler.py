@@ -1,21 +1,37 @@
+import logging
 import schedule
 import time
+from datetime import datetime, date
 from book import Booking
 from config import Config
 from config_setup import setup_config
+from clock_sync import server_clock
+from logging_config import setup_logging
+
+logger = logging.getLogger(__name__)
 
 def check_booking_conditions():
     """判断是否在可预约时间内并执行预约"""
     if Config.is_booking_time():
-        print("当前时间在可预约时间段内，开始执行预约流程...")
+        logger.info("当前时间在可预约时间段内，开始执行预约流程...")
         Booking.book_venue()  # 直接调用预约函数
     else:
-        print(f"当前时间不在预约时间段内（{Config.BOOKING_HOURS[0]}:00 - {Config.BOOKING_HOURS[1]}:00）")
+        logger.info("当前时间不在预约时间段内（%s:00 - %s:00）", Config.BOOKING_HOURS[0], Config.BOOKING_HOURS[1])
+
+def local_schedule_time():
+    """将服务器时间的 Config.SCHEDULE_TIME 换算为本地时间（精确到秒）"""
+    try:
+        server_clock.calibrate()
+    except Exception as e:
+        logger.warning("服务器时钟校准失败，按本地时间执行: %s", e)
+        return Config.SCHEDULE_TIME
+    server_time = datetime.combine(date.today(), datetime.strptime(Config.SCHEDULE_TIME, "%H:%M").time())
+    return server_clock.to_local(server_time).strftime("%H:%M:%S")
 
 def start_scheduler():
     """启动定时任务，每天在设定的时间运行"""
-    schedule_time = Config.SCHEDULE_TIME
-    print(f"设置定时任务，每天 {schedule_time} 执行")
+    schedule_time = local_schedule_time()
+    logger.info("设置定时任务，每天 %s 执行", schedule_time)
     schedule.every().day.at(schedule_time).do(check_booking_conditions)
 
     while True:
@@ -23,5 +39,6 @@ def start_scheduler():
         time.sleep(1)  # 每60秒检查一次任务是否需要执行
 
 if __name__ == "__main__":
+    setup_logging()
     setup_config()
     start_scheduler()
@@ -0,0 +1,131 @@
+"""
+登录会话池
+按账号复用已认证的 requests.Session，避免每次预约都重新登录
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from login import Login
+from metrics import OPEN_SESSIONS
+
+logger = logging.getLogger(__name__)
+
+
+def is_session_rejected(response, expect_json: bool = True) -> bool:
+    """判断服务器是否拒绝了当前会话（会话过期后接口会返回登录页而不是JSON）"""
+    if response.status_code in (401, 403):
+        return True
+    if "login.html" in str(response.url):
+        return True
+    if response.status_code != 200 or not expect_json:
+        return False
+    try:
+        response.json()
+    except ValueError:
+        return True
+    return False
+
+
+class PooledSession:
+    """会话池中的单个条目"""
+
+    def __init__(self, username: str, password: str, session):
+        self.username = username
+        self.password = password
+        self.session = session
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+    def is_expired(self, ttl: float, max_idle: float) -> bool:
+        now = time.monotonic()
+        return now - self.created_at >= ttl or now - self.last_used >= max_idle
+
+
+class SessionPool:
+    """按账号缓存登录会话，支持过期检测、失效和预热"""
+
+    def __init__(self, ttl: float = None, max_idle: float = None):
+        self.ttl = ttl if ttl is not None else Config.SESSION_TTL
+        self.max_idle = max_idle if max_idle is not None else Config.SESSION_MAX_IDLE
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._account_locks = {}
+
+    def _account_lock(self, username: str) -> threading.Lock:
+        # 同一账号的登录串行化，避免并发任务重复登录
+        with self._lock:
+            lock = self._account_locks.get(username)
+            if lock is None:
+                lock = self._account_locks[username] = threading.Lock()
+            return lock
+
+    def checkout(self, username: str, password: str):
+        """获取账号的已登录会话，不存在或已过期时重新登录"""
+        return self.acquire(username, password)[0]
+
+    def acquire(self, username: str, password: str):
+        """同 checkout，返回 (会话, 是否本次调用了 pre_login)"""
+        with self._account_lock(username):
+            entry = self._entries.get(username)
+            if entry and entry.password == password and not entry.is_expired(self.ttl, self.max_idle):
+                entry.last_used = time.monotonic()
+                return entry.session, False
+
+            # 先登录，成功后才替换池中的旧会话，登录失败（如密码错误）时旧会话保持不变
+            session = Login(username, password).pre_login()
+            self._entries[username] = PooledSession(username, password, session)
+            if entry:
+                entry.session.close()
+            return session, True
+
+    def invalidate(self, username: str, session=None):
+        """服务器拒绝会话时调用，下一次 checkout 会重新登录
+
+        传入 session 时只有池中仍是该会话才会失效，避免误删其他线程刚换上的新会话
+        """
+        with self._lock:
+            entry = self._entries.get(username)
+            if not entry or (session is not None and entry.session is not session):
+                return
+            del self._entries[username]
+        entry.session.close()
+        logger.info("账号 %s 的会话已失效", username, extra={"account": username})
+
+    def prewarm(self, accounts) -> int:
+        """提前为一批账号登录，accounts 为 (username, password) 序列，返回成功数量"""
+        accounts = list(dict(accounts).items())
+        if not accounts:
+            return 0
+
+        def warm(account):
+            username, password = account
+            try:
+                self.checkout(username, password)
+                return True
+            except Exception as e:
+                logger.warning("账号 %s 预热登录失败: %s", username, e, extra={"account": username})
+                return False
+
+        with ThreadPoolExecutor(max_workers=min(len(accounts), Config.SESSION_PREWARM_WORKERS)) as pool:
+            warmed = sum(pool.map(warm, accounts))
+        logger.info("预热完成: %d/%d 个账号", warmed, len(accounts))
+        return warmed
+
+    def clear(self):
+        """关闭并清空所有会话"""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            entry.session.close()
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+# 进程内共享的会话池
+session_pool = SessionPool()
+OPEN_SESSIONS.set_function(session_pool.size)
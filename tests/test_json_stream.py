@@ -0,0 +1,30 @@
+"""iter_json_array 的边界用例：在各种分块大小下与 json.loads 的结果一致，格式错误时抛出 ValueError"""
+import io
+import json
+
+import pytest
+
+from json_stream import iter_json_array
+
+CHUNK_SIZES = (1, 2, 3, 5, 64)
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("text", [
+    '[]',
+    ' [ ] ',
+    '[1.5e3]',
+    '[1.5e3, -2, 0.25E-1]',
+    '[true,false,null]',
+    '["a,]", {"b": [1, 2]}]',
+    '[\n  {"id": 1},\n  {"id": 2}\n]',
+])
+def test_valid_arrays(text, chunk_size):
+    assert list(iter_json_array(io.StringIO(text), chunk_size)) == json.loads(text)
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("text", ['[1 2]', '[1,,2]', '[1,]', '[,1]', '[1', '{"a": 1}'])
+def test_invalid_arrays(text, chunk_size):
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO(text), chunk_size))